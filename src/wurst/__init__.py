@@ -1,11 +1,15 @@
 __all__ = (
     "best_geo_match",
+    "best_geo_matches",
     "biosphere",
     "change_exchanges_by_constant_factor",
+    "classify",
+    "ConsumerIndex",
     "contains",
     "copy_to_new_location",
     "create_dir",
     "create_log",
+    "DatasetIndex",
     "debug_logging",
     "default_global_location",
     "delete_zero_amount_exchanges",
@@ -15,12 +19,15 @@ __all__ = (
     "equals",
     "extract_brightway2_databases",
     "geomatcher",
+    "get_first",
     "get_many",
     "get_one",
     "log",
     "production",
+    "ProviderIndex",
     "reference_product",
     "relink_technosphere_exchanges",
+    "relink_technosphere_exchanges_many",
     "rescale_exchange",
     "resolved_row",
     "startswith",
@@ -64,13 +71,17 @@ from constructive_geometries import resolved_row
 
 from wurst.filesystem import create_dir, create_log
 from wurst.geo import geomatcher
+from wurst.indexing import ConsumerIndex, DatasetIndex, ProviderIndex
 from wurst.searching import (
     best_geo_match,
+    best_geo_matches,
     biosphere,
+    classify,
     contains,
     doesnt_contain_any,
     either,
     equals,
+    get_first,
     get_many,
     get_one,
     production,
@@ -85,5 +96,6 @@ from wurst.transformations import (
     delete_zero_amount_exchanges,
     empty_market_dataset,
     relink_technosphere_exchanges,
+    relink_technosphere_exchanges_many,
     rescale_exchange,
 )
@@ -6,9 +6,12 @@ except ImportError:
     from bw2data.backends import SQLiteBackend, ActivityDataset, ExchangeDataset
 
 import copy
+from time import perf_counter
 
 from tqdm import tqdm
 
+from wurst.linking import measure_pass
+
 
 def _list_or_dict(obj):
     if isinstance(obj, dict):
@@ -94,62 +97,86 @@ def add_exchanges_to_consumers(
     return activities
 
 
-def add_input_info_for_indigenous_exchanges(activities, names, add_identifiers=False):
-    """Add details on exchange inputs if these activities are already available"""
-    names = set(names)
-    lookup = {(o["database"], o["code"]): o for o in activities}
+def add_input_info_for_indigenous_exchanges(
+    activities, names, add_identifiers=False, metrics=None
+):
+    """Add details on exchange inputs if these activities are already available.
 
-    for ds in activities:
-        for exc in ds["exchanges"]:
-            if "input" not in exc or exc["input"][0] not in names:
-                continue
-            obj = lookup[exc["input"]]
-            exc["product"] = obj.get("reference product")
-            exc["name"] = obj.get("name")
-            exc["unit"] = obj.get("unit")
-            exc["location"] = obj.get("location")
-            exc["database"] = obj.get("database")
-            if add_identifiers:
-                exc["id"] = obj["id"]
-                exc["code"] = obj["code"]
-            if exc["type"] == "biosphere":
-                exc["categories"] = obj.get("categories")
-            exc.pop("input")
-
-
-def add_input_info_for_external_exchanges(activities, names, add_identifiers=False):
-    """Add details on exchange inputs from other databases"""
-    names = set(names)
-    cache = {}
-
-    for ds in tqdm(activities):
-        for exc in ds["exchanges"]:
-            if "input" not in exc or exc["input"][0] in names:
-                continue
-            if exc["input"] not in cache:
-                cache[exc["input"]] = ActivityDataset.get(
-                    ActivityDataset.database == exc["input"][0],
-                    ActivityDataset.code == exc["input"][1],
-                )
-            obj = cache[exc["input"]]
-            exc["name"] = obj.name
-            exc["product"] = obj.product
-            exc["unit"] = obj.data.get("unit")
-            exc["location"] = obj.location
-            exc["database"] = obj.database
-            if add_identifiers:
-                exc["id"] = obj.id
-                exc["code"] = obj.code
-            if exc["type"] == "biosphere":
-                exc["categories"] = obj.data.get("categories")
+    If a ``LinkingMetrics`` is given as ``metrics``, the counts and timings of this pass are recorded there.
+    """
+    with measure_pass(metrics, "add_input_info_for_indigenous_exchanges") as stats:
+        start = perf_counter()
+        names = set(names)
+        lookup = {(o["database"], o["code"]): o for o in activities}
+        stats["index_time"] = perf_counter() - start
+
+        for ds in activities:
+            stats["exchanges"] += len(ds["exchanges"])
+            for exc in ds["exchanges"]:
+                if "input" not in exc or exc["input"][0] not in names:
+                    continue
+                obj = lookup[exc["input"]]
+                stats["hits"] += 1
+                exc["product"] = obj.get("reference product")
+                exc["name"] = obj.get("name")
+                exc["unit"] = obj.get("unit")
+                exc["location"] = obj.get("location")
+                exc["database"] = obj.get("database")
+                if add_identifiers:
+                    exc["id"] = obj["id"]
+                    exc["code"] = obj["code"]
+                if exc["type"] == "biosphere":
+                    exc["categories"] = obj.get("categories")
+                exc.pop("input")
+        stats["datasets"] = len(activities)
+        stats["skipped"] = stats["exchanges"] - stats["hits"]
+
+
+def add_input_info_for_external_exchanges(
+    activities, names, add_identifiers=False, metrics=None
+):
+    """Add details on exchange inputs from other databases.
+
+    If a ``LinkingMetrics`` is given as ``metrics``, the counts and timings of this pass are recorded there; ``misses`` are inputs which weren't cached yet, and needed a database query.
+    """
+    with measure_pass(metrics, "add_input_info_for_external_exchanges") as stats:
+        names = set(names)
+        cache = {}
+
+        for ds in tqdm(activities):
+            stats["exchanges"] += len(ds["exchanges"])
+            for exc in ds["exchanges"]:
+                if "input" not in exc or exc["input"][0] in names:
+                    continue
+                if exc["input"] not in cache:
+                    stats["misses"] += 1
+                    cache[exc["input"]] = ActivityDataset.get(
+                        ActivityDataset.database == exc["input"][0],
+                        ActivityDataset.code == exc["input"][1],
+                    )
+                else:
+                    stats["hits"] += 1
+                obj = cache[exc["input"]]
+                exc["name"] = obj.name
+                exc["product"] = obj.product
+                exc["unit"] = obj.data.get("unit")
+                exc["location"] = obj.location
+                exc["database"] = obj.database
+                if add_identifiers:
+                    exc["id"] = obj.id
+                    exc["code"] = obj.code
+                if exc["type"] == "biosphere":
+                    exc["categories"] = obj.data.get("categories")
+        stats["datasets"] = len(activities)
+        stats["skipped"] = stats["exchanges"] - stats["hits"] - stats["misses"]
 
 
 def extract_brightway2_databases(
-    database_names, add_properties=False, add_identifiers=False
+    database_names, add_properties=False, add_identifiers=False, metrics=None
 ):
     """Extract a Brightway2 SQLiteBackend database to the Wurst internal format.
 
-    ``database_names`` is a list of database names. You should already be in the correct project.
+    ``database_names`` is a list of database names. You should already be in the correct project. ``metrics`` is an optional ``LinkingMetrics``, passed to the functions which fill in exchange details.
 
     Returns a list of dataset documents."""
     ERROR = "Must pass list of database names"
@@ -181,9 +208,9 @@ def extract_brightway2_databases(
     # Add details on exchanges which come from our databases
     print("Filling out exchange data")
     add_input_info_for_indigenous_exchanges(
-        activities, database_names, add_identifiers=add_identifiers
+        activities, database_names, add_identifiers=add_identifiers, metrics=metrics
     )
     add_input_info_for_external_exchanges(
-        activities, database_names, add_identifiers=add_identifiers
+        activities, database_names, add_identifiers=add_identifiers, metrics=metrics
     )
     return activities
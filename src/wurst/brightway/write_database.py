@@ -5,10 +5,11 @@ from bw2io.importers.base_lci import LCIImporter
 
 from wurst import logger
 from wurst.linking import (
+    InternalLinker,
+    KeyRegistry,
     change_db_name,
-    check_duplicate_codes,
-    check_internal_linking,
     link_internal,
+    validate_links,
 )
 
 
@@ -105,6 +106,8 @@ def write_brightway2_database(
     name: str,
     metadata: Optional[dict] = None,
     products_and_processes: bool = False,
+    linker: Optional[InternalLinker] = None,
+    registry: Optional[KeyRegistry] = None,
 ) -> None:
     """Write a new database as a new Brightway2 database named ``name``.
 
@@ -113,11 +116,13 @@ def write_brightway2_database(
     This function will do the following:
 
     * Change the database name for all activities and internal exchanges to ``name``. All activities will have the new database ``name``, even if the original data came from multiple databases.
-    * Relink exchanges using the default fields: ``('name', 'product', 'location', 'unit')``.
+    * Relink exchanges using the default fields: ``('name', 'product', 'location', 'unit')``. If an ``InternalLinker`` is passed as ``linker``, it is used instead, so only datasets changed since its last use are relinked.
     * Check that all internal links resolve to actual activities, If the ``input`` value is ``('name', 'bar')``, there must be an activity with the code ``bar``.
-    * Check to make sure that all activity codes are unique
+    * Check to make sure that all activity codes are unique. Both checks are done by ``validate_links``, and report all problems at once.
     * Write the data to a new Brightway2 SQLite database
 
+    If a ``KeyRegistry`` is passed as ``registry``, linking and checking is done with integer ids, which are resolved to ``(database, code)`` tuples just before writing.
+
     Will raise an assertion error is ``name`` already exists.
 
     Doesn't return anything."""
@@ -130,17 +135,25 @@ def write_brightway2_database(
                 name: {"amount": amount} for name, amount in ds["parameters"].items()
             }
 
-    change_db_name(data, name)
+    change_db_name(data, name, registry=registry)
     if products_and_processes:
         link_internal_products_processes(data)
+    elif linker is not None:
+        linker.link(data)
     else:
-        link_internal(data)
-    check_internal_linking(data)
-    check_duplicate_codes(data)
+        link_internal(data, registry=registry)
+    validate_links(data, registry=registry).raise_for_problems()
+    if registry is not None:
+        registry.resolve_links(data)
     WurstImporter(name, data).write_database(metadata)
 
 
-def write_brightway2_array_database(data: List[dict], name: str) -> None:
+def write_brightway2_array_database(
+    data: List[dict],
+    name: str,
+    linker: Optional[InternalLinker] = None,
+    registry: Optional[KeyRegistry] = None,
+) -> None:
     """Write a new database using the ``IOTable`` backend that saves exchange values only as processed arrays.
 
     You should be in the correct project already.
@@ -148,11 +161,13 @@ def write_brightway2_array_database(data: List[dict], name: str) -> None:
     This function will do the following:
 
     * Change the database name for all activities and internal exchanges to ``name``. All activities will have the new database ``name``, even if the original data came from multiple databases.
-    * Relink exchanges using the default fields: ``('name', 'product', 'location', 'unit')``.
+    * Relink exchanges using the default fields: ``('name', 'product', 'location', 'unit')``, or the ``InternalLinker`` passed as ``linker``.
     * Check that all internal links resolve to actual activities, If the ``input`` value is ``('name', 'bar')``, there must be an activity with the code ``bar``.
-    * Check to make sure that all activity codes are unique
+    * Check to make sure that all activity codes are unique. Both checks are done by ``validate_links``, and report all problems at once.
     * Write the data to a new Brightway2 IOTable
 
+    If a ``KeyRegistry`` is passed as ``registry``, linking and checking is done with integer ids, which are resolved to ``(database, code)`` tuples just before writing.
+
     Will raise an assertion error is ``name`` already exists.
 
     Doesn't return anything."""
@@ -165,10 +180,14 @@ def write_brightway2_array_database(data: List[dict], name: str) -> None:
                 name: {"amount": amount} for name, amount in ds["parameters"].items()
             }
 
-    change_db_name(data, name)
-    link_internal(data)
-    check_internal_linking(data)
-    check_duplicate_codes(data)
+    change_db_name(data, name, registry=registry)
+    if linker is not None:
+        linker.link(data)
+    else:
+        link_internal(data, registry=registry)
+    validate_links(data, registry=registry).raise_for_problems()
+    if registry is not None:
+        registry.resolve_links(data)
 
     exchanges = []
 
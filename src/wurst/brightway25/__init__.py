@@ -5,11 +5,17 @@ from typing import List, Optional
 
 import bw2data as bd
 import bw_processing as bwp
+import numpy as np
 from bw2data.backends import ActivityDataset
 from bw2io.importers.base_lci import LCIImporter
 from fs.zipfs import ZipFS
 
-from wurst.linking import check_duplicate_codes, check_internal_linking, link_internal
+from wurst.linking import (
+    InternalLinker,
+    KeyRegistry,
+    link_internal,
+    validate_links,
+)
 
 
 class DeltaImporter(LCIImporter):
@@ -32,7 +38,11 @@ PRODUCTION = ("production", "substitution", "generic production")
 
 
 def write_brightway25_database(
-    data: List[dict], name: str, metadata: Optional[dict] = None
+    data: List[dict],
+    name: str,
+    metadata: Optional[dict] = None,
+    linker: Optional[InternalLinker] = None,
+    registry: Optional[KeyRegistry] = None,
 ) -> bd.Database:
     """Write a new database compatible with Brightway 2.5 functionality.
 
@@ -49,6 +59,9 @@ def write_brightway25_database(
 
     * ``data``: list. Datasets in the standard Wurst format
     * ``name``: str. Name of the new database. Will raise an ``AssertionError`` if ``name`` already exists.
+    * ``metadata``: dict, optional. Metadata for the new database.
+    * ``linker``: ``wurst.linking.InternalLinker``, optional. Used instead of ``link_internal``, so only datasets changed since its last use are relinked.
+    * ``registry``: ``wurst.linking.KeyRegistry``, optional. Link with integer ids, and map them to Brightway ids with an array lookup. Links in ``data`` are resolved to ``(database, code)`` tuples again once the mapping is built.
 
     Returns:
 
@@ -59,7 +72,7 @@ def write_brightway25_database(
     * Change the database name for new activities to ``name``.
     * Relink exchanges using the default fields: ``('name', 'product', 'location', 'unit')``.
     * Check that all internal links resolve to actual activities, If the ``input`` value is ``('name', 'bar')``, there must be an activity with the code ``bar``.
-    * Check to make sure that all activity codes in the new activities are unique
+    * Check to make sure that all activity codes in the new activities are unique. Both checks are done by ``validate_links``, and report all problems at once.
 
     """
     assert name not in bd.databases, "This database already exists"
@@ -76,10 +89,12 @@ def write_brightway25_database(
     # Links to external databases (i.e. those not imported in their entirety)
     # are maintained; the exchanges have ``input`` keys. This will link
     # the exchanges against activities in ``data``.
-    link_internal(data)
+    if linker is not None:
+        linker.link(data)
+    else:
+        link_internal(data, registry=registry)
 
-    check_internal_linking(data)
-    check_duplicate_codes(new_activities)
+    validate_links(data, registry=registry, unique=new_activities).raise_for_problems()
 
     new_activities = [strip_exchanges(x) for x in data if x.get("modified")]
     DeltaImporter(name, new_activities).write_database(metadata)
@@ -91,14 +106,18 @@ def write_brightway25_database(
         .difference({None})
     )
 
-    id_mapping = {
-        (t[0], t[1]): t[2]
-        for t in ActivityDataset.select(
+    rows = (
+        ActivityDataset.select(
             ActivityDataset.database, ActivityDataset.code, ActivityDataset.id
         )
         .where(ActivityDataset.database << dependents)
         .tuples()
-    }
+    )
+    if registry is None:
+        id_mapping = {(t[0], t[1]): t[2] for t in rows}
+    else:
+        id_mapping = _RegistryIdMapping(registry, rows)
+        registry.resolve_links(data)
 
     # Construct processed array manually
     tech_exchanges = []
@@ -160,6 +179,28 @@ def write_brightway25_database(
     return bd.Database(name)
 
 
+class _RegistryIdMapping:
+    """Mapping from ``KeyRegistry`` integer ids (or ``(database, code)`` tuples) to Brightway ids, stored as an array indexed by registry id."""
+
+    def __init__(self, registry, rows):
+        pairs = [(registry.id((t[0], t[1])), t[2]) for t in rows]
+        self.registry = registry
+        self.array = np.zeros(len(registry) + 1, dtype=np.int64)
+        if pairs:
+            ids, bw_ids = zip(*pairs)
+            self.array[list(ids)] = bw_ids
+
+    def __getitem__(self, key):
+        if not isinstance(key, int):
+            id_ = self.registry.get(key)
+            if id_ is None:
+                raise KeyError(key)
+            key = id_
+        if key >= len(self.array) or not self.array[key]:
+            raise KeyError(self.registry.key(key))
+        return int(self.array[key])
+
+
 def process_delta_database(name, tech, bio, dependents):
     """A modification of ``bw2data.backends.base.SQLiteBackend.process`` to skip retrieving data from the database."""
     print("Tech:", tech)
@@ -0,0 +1,154 @@
+"""Columnar view of dataset metadata, for vectorized searching of large databases."""
+import numpy as np
+
+from wurst.searching import (
+    Contains,
+    DoesntContainAny,
+    Either,
+    Equals,
+    Exclude,
+    In,
+    StartsWith,
+    plan,
+)
+
+COLUMNS = (
+    "name",
+    "reference product",
+    "unit",
+    "location",
+    "database",
+    "code",
+    "type",
+)
+SINGLE_FIELD = (Contains, DoesntContainAny, Equals, In, StartsWith)
+
+
+class CategoricalColumn:
+    """Values of one field stored as integer ``codes`` into a list of unique ``categories``."""
+
+    def __init__(self):
+        self.categories = []
+        self.lookup = {}
+        self.codes = np.zeros(0, dtype=np.int32)
+
+    def extend(self, values):
+        codes = np.empty(len(values), dtype=np.int32)
+        for i, value in enumerate(values):
+            try:
+                codes[i] = self.lookup[value]
+            except KeyError:
+                codes[i] = self.lookup[value] = len(self.categories)
+                self.categories.append(value)
+        self.codes = np.concatenate([self.codes, codes])
+
+    def mask(self, func, field):
+        """Evaluate single-field filter ``func`` once per category, and broadcast the result to all rows."""
+        if isinstance(func, Equals):
+            try:
+                code = self.lookup.get(func.value)
+            except TypeError:
+                code = None
+            return self.codes == (-1 if code is None else code)
+        matches = np.fromiter(
+            (func({field: value}) for value in self.categories),
+            dtype=bool,
+            count=len(self.categories),
+        )
+        return matches[self.codes]
+
+
+class ColumnarDatabase:
+    """Columnar, read-mostly view of the metadata of a list of datasets ``data``.
+
+    Each field in ``columns`` is stored as a ``CategoricalColumn`` of NumPy integer codes. When passed to ``get_many`` or ``get_one``, ``equals``, ``contains``, ``startswith`` and ``doesnt_contain_any`` filters on these fields (and ``either`` and ``exclude`` filters built from them) are compiled to boolean masks. String tests are evaluated once per unique value instead of once per dataset. Other filters are applied to the datasets selected by the masks.
+
+    .. code-block:: python
+
+        table = ColumnarDatabase(data)
+        get_many(table, contains("name", "electricity"), equals("unit", "kilowatt hour"))
+
+    The datasets themselves are not copied; search results are the dataset dictionaries in ``data``. Datasets appended to ``data`` are added on the next search; if metadata is changed in place, call ``rebuild``.
+    """
+
+    def __init__(self, data, columns=COLUMNS):
+        self.data = data
+        self.columns = {}
+        self._fields = tuple(columns)
+        self.rebuild()
+
+    def __iter__(self):
+        return iter(self.data)
+
+    def __len__(self):
+        return len(self.data)
+
+    def __getitem__(self, key):
+        return self.data[key]
+
+    def append(self, ds):
+        self.data.append(ds)
+
+    def extend(self, datasets):
+        self.data.extend(datasets)
+
+    def rebuild(self):
+        """Rebuild all columns from ``data``."""
+        self.columns = {field: CategoricalColumn() for field in self._fields}
+        self._size = 0
+        self._sync()
+
+    def touch(self, fields=()):
+        """Record that datasets were modified; rebuilds columns if any of ``fields`` were changed."""
+        if set(fields).intersection(self._fields):
+            self.rebuild()
+
+    def _sync(self):
+        size = len(self.data)
+        if size < self._size:
+            return self.rebuild()
+        elif size == self._size:
+            return
+        new = [self.data[i] for i in range(self._size, size)]
+        for field in list(self.columns):
+            try:
+                self.columns[field].extend([ds.get(field) for ds in new])
+            except TypeError:
+                # Unhashable values; can't use this field
+                del self.columns[field]
+        self._size = size
+
+    def mask(self, func):
+        """Compile filter ``func`` to a boolean array over all datasets.
+
+        Returns ``None`` if ``func`` can't be evaluated on the columns."""
+        self._sync()
+        if isinstance(func, SINGLE_FIELD):
+            if func.field not in self.columns:
+                return None
+            return self.columns[func.field].mask(func, func.field)
+        elif isinstance(func, Either):
+            masks = [self.mask(f) for f in func.funcs]
+            if not masks or any(mask is None for mask in masks):
+                return None
+            return np.logical_or.reduce(masks)
+        elif isinstance(func, Exclude):
+            mask = self.mask(func.func)
+            return None if mask is None else ~mask
+
+    def get_many(self, *funcs):
+        """Apply all filter functions ``funcs``, using vectorized masks where possible."""
+        self._sync()
+        selected = np.ones(len(self.data), dtype=bool)
+        remaining = []
+        for func in plan(funcs):
+            mask = self.mask(func)
+            if mask is None:
+                remaining.append(func)
+            else:
+                selected &= mask
+
+        datasets = (self.data[i] for i in np.flatnonzero(selected))
+        for func in remaining:
+            datasets = filter(func, datasets)
+        return datasets
@@ -1,6 +1,7 @@
 from functools import partial
 
 from wurst import toolz
+from wurst.indexing import mark_modified
 from wurst.searching import equals, get_many
 from wurst.transformations import rescale_exchange
 
@@ -157,6 +158,7 @@ def move_all_generation_to_high_voltage(data):
         high["exchanges"].extend(
             [exc for exc in low["exchanges"] if exc["name"] in low_voltage_providers]
         )
+    mark_modified(data)
     data = empty_medium_voltage_markets(data)
     data = empty_low_voltage_markets(data)
     return data
@@ -174,6 +176,7 @@ def remove_electricity_trade(data):
             for exc in ds["exchanges"]
             if not ("electricity" in exc["name"] and "import from" in exc["name"])
         ]
+    mark_modified(data)
     return data
 
 
@@ -198,6 +201,7 @@ def _empty(data, kind):
         elif kind == medium_voltage_mix:
             set_conversion_to_one_kwh(ds, high_voltage_transformation)
 
+    mark_modified(data)
     return data
 
 
@@ -42,3 +42,18 @@ biomass_combined_cycle_electricity = [
 ]
 
 nuclear_electricity = [_nuclear, _electricity, _kwh]
+
+electricity_technologies = {
+    "coal": coal_electricity,
+    "coal CHP": coal_chp_electricity,
+    "gas open cycle": gas_open_cycle_electricity,
+    "gas combined cycle": gas_combined_cycle_electricity,
+    "gas CHP": gas_chp_electricity,
+    "oil open cycle": oil_open_cycle_electricity,
+    "oil combined cycle": oil_combined_cycle_electricity,
+    "oil CHP": oil_chp_electricity,
+    "biomass": biomass_electricity,
+    "biomass CHP": biomass_chp_electricity,
+    "biomass combined cycle": biomass_combined_cycle_electricity,
+    "nuclear": nuclear_electricity,
+}
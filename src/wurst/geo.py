@@ -6,3 +6,86 @@ from wurst.REMIND import REMIND_TOPOLOGY
 geomatcher = Geomatcher(backwards_compatible=True)
 # geomatcher.add_definitions(IMAGE_TOPOLOGY, "IMAGE", relative=True)
 # geomatcher.add_definitions(REMIND_TOPOLOGY, "REMIND", relative=True)
+
+
+class BitsetTopology:
+    """Faces of the locations in a ``Geomatcher`` as integer bitmasks.
+
+    Each topological face gets one bit, and the mask of a location is the integer with the bits of all its faces set. Containment, intersection, union and difference of locations are then bitwise operations on integers instead of operations on sets of face ids.
+
+    .. code-block:: python
+
+        topology.contains("RER", "CH")  # True
+        topology.difference("RER", ["CH", "DE"])  # Mask of faces in RER, but not in CH or DE
+
+    Masks are computed on first use and cached, except for ``RoW`` and ``RoE``, whose faces depend on the ``resolved_row`` context. Call ``clear`` after changing the definitions of existing locations.
+    """
+
+    UNCACHED = ("RoW", "RoE")
+
+    def __init__(self, matcher):
+        self.matcher = matcher
+        self.bits = {}
+        self.masks = {}
+
+    def clear(self):
+        """Drop all cached masks."""
+        self.masks = {}
+
+    def mask(self, location):
+        """Return the bitmask of the faces of ``location``."""
+        try:
+            return self.masks[location]
+        except KeyError:
+            pass
+        mask, bits = 0, self.bits
+        for face in self.matcher[location]:
+            try:
+                mask |= 1 << bits[face]
+            except KeyError:
+                bits[face] = len(bits)
+                mask |= 1 << bits[face]
+        if location not in self.UNCACHED:
+            self.masks[location] = mask
+        return mask
+
+    def union(self, locations):
+        """Return the bitmask of the faces in any of ``locations``."""
+        mask = 0
+        for location in locations:
+            mask |= self.mask(location)
+        return mask
+
+    def difference(self, location, locations):
+        """Return the bitmask of the faces of ``location`` which are not in any of ``locations``."""
+        return self.mask(location) & ~self.union(locations)
+
+    def contains(self, location, other):
+        """Return ``True`` if all faces of ``other`` are in ``location``."""
+        return not self.mask(other) & ~self.mask(location)
+
+    def intersects(self, location, other):
+        """Return ``True`` if ``location`` and ``other`` have a face in common."""
+        return bool(self.mask(location) & self.mask(other))
+
+    def contained(self, location, candidates):
+        """Return list of the locations in ``candidates`` which are non-empty and completely within ``location``."""
+        mask = self.mask(location)
+        return [c for c in candidates if self.mask(c) and not self.mask(c) & ~mask]
+
+    def within(self, location, candidates):
+        """Return list of the locations in ``candidates`` which completely contain ``location``."""
+        mask = self.mask(location)
+        return [c for c in candidates if not mask & ~self.mask(c)]
+
+    def faces(self, mask):
+        """Return the set of face ids in bitmask ``mask``."""
+        return {face for face, bit in self.bits.items() if mask >> bit & 1}
+
+    @staticmethod
+    def size(mask):
+        """Return the number of faces in bitmask ``mask``."""
+        return bin(mask).count("1")
+
+
+topology = BitsetTopology(geomatcher)
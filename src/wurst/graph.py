@@ -0,0 +1,214 @@
+"""Supply chain graph of linked datasets, stored as compressed sparse row (CSR) arrays."""
+import numpy as np
+
+
+def _csr(sources, targets, size):
+    """Return ``(indptr, indices)`` with the ``targets`` of each source in ``sources``."""
+    order = np.argsort(sources, kind="stable")
+    indptr = np.zeros(size + 1, dtype=np.int64)
+    np.cumsum(np.bincount(sources, minlength=size), out=indptr[1:])
+    return indptr, targets[order]
+
+
+class TechnosphereGraph:
+    """Directed graph of the technosphere links between the datasets in ``data``.
+
+    Each dataset is a node, and each linked exchange of one of the ``types`` is an edge from the consuming dataset to its provider (the dataset whose ``(database, code)`` is the exchange ``input``). Exchanges linking to datasets outside ``data``, and links of a dataset to itself, are ignored. If ``data`` was linked with a ``KeyRegistry``, pass it as ``registry`` to resolve integer ``input`` values.
+
+    Edges are stored in both directions as NumPy CSR arrays: the providers of node ``i`` are ``upstream_indices[upstream_indptr[i]:upstream_indptr[i + 1]]``, and its consumers are likewise in ``downstream_indptr`` and ``downstream_indices``.
+
+    .. code-block:: python
+
+        graph = TechnosphereGraph(data)
+        graph.consumers(ds)  # Datasets which use ``ds`` directly
+        graph.downstream(ds, max_depth=3)  # Up to three steps downstream
+        graph.upstream(ds)  # Complete supply chain of ``ds``
+
+    The graph is not updated when ``data`` changes; build a new one after relinking.
+    """
+
+    def __init__(self, data, types=("technosphere",), registry=None):
+        self.data = list(data)
+        self.positions = {
+            (ds["database"], ds["code"]): i for i, ds in enumerate(self.data)
+        }
+        consumers, providers = [], []
+        for i, ds in enumerate(self.data):
+            for exc in ds["exchanges"]:
+                if exc["type"] not in types or not exc.get("input"):
+                    continue
+                key = exc["input"]
+                if registry is not None:
+                    key = registry.resolve(key)
+                j = self.positions.get(tuple(key))
+                if j is not None and j != i:
+                    consumers.append(i)
+                    providers.append(j)
+
+        consumers = np.array(consumers, dtype=np.int64)
+        providers = np.array(providers, dtype=np.int64)
+        self.upstream_indptr, self.upstream_indices = _csr(
+            consumers, providers, len(self.data)
+        )
+        self.downstream_indptr, self.downstream_indices = _csr(
+            providers, consumers, len(self.data)
+        )
+
+    def __len__(self):
+        return len(self.data)
+
+    @property
+    def edges(self):
+        """Number of edges."""
+        return len(self.upstream_indices)
+
+    def index(self, node):
+        """Return the position of ``node`` in ``data``.
+
+        ``node`` can be a position, a ``(database, code)`` key, or a dataset."""
+        if isinstance(node, (int, np.integer)):
+            return int(node)
+        elif isinstance(node, dict):
+            node = (node["database"], node["code"])
+        return self.positions[tuple(node)]
+
+    def _arrays(self, direction):
+        if direction == "upstream":
+            return self.upstream_indptr, self.upstream_indices
+        elif direction == "downstream":
+            return self.downstream_indptr, self.downstream_indices
+        raise ValueError("Unknown direction: {}".format(direction))
+
+    def neighbours(self, node, direction="upstream"):
+        """Return array of positions of direct providers (``upstream``) or consumers (``downstream``) of ``node``."""
+        indptr, indices = self._arrays(direction)
+        i = self.index(node)
+        return np.unique(indices[indptr[i] : indptr[i + 1]])
+
+    def bfs(self, nodes, direction="upstream", max_depth=None):
+        """Breadth-first search from ``nodes`` (a node, or a list of nodes).
+
+        Returns array of positions of all reachable nodes, in order of distance and then position, not including the start nodes. Each level is expanded with vectorized array operations. ``max_depth`` limits the number of steps; ``1`` gives direct neighbours.
+        """
+        indptr, indices = self._arrays(direction)
+        if isinstance(nodes, (list, set, np.ndarray)):
+            starts = [self.index(node) for node in nodes]
+        else:
+            starts = [self.index(nodes)]
+
+        visited = np.zeros(len(self.data), dtype=bool)
+        frontier = np.unique(np.array(starts, dtype=np.int64))
+        visited[frontier] = True
+        found, depth = [], 0
+        while len(frontier) and (max_depth is None or depth < max_depth):
+            begin, end = indptr[frontier], indptr[frontier + 1]
+            lengths = end - begin
+            # Positions in ``indices`` of all edges leaving the frontier
+            offsets = np.repeat(begin - np.cumsum(lengths) + lengths, lengths)
+            neighbours = indices[offsets + np.arange(lengths.sum())]
+            frontier = np.unique(neighbours[~visited[neighbours]])
+            visited[frontier] = True
+            found.append(frontier)
+            depth += 1
+        return np.concatenate(found) if found else np.zeros(0, dtype=np.int64)
+
+    def dfs(self, node, direction="upstream", max_depth=None):
+        """Depth-first search from ``node``.
+
+        Returns list of positions of all reachable nodes in preorder, not including ``node``. ``max_depth`` limits the length of the followed paths.
+        """
+        indptr, indices = self._arrays(direction)
+        start = self.index(node)
+        visited = {start}
+        order = []
+        stack = [(start, 0)]
+        while stack:
+            i, depth = stack.pop()
+            if i != start:
+                order.append(i)
+            if max_depth is not None and depth >= max_depth:
+                continue
+            # Reversed, so that neighbours are visited in order of position
+            for j in indices[indptr[i] : indptr[i + 1]][::-1]:
+                j = int(j)
+                if j not in visited:
+                    visited.add(j)
+                    stack.append((j, depth + 1))
+        return order
+
+    def upstream(self, node, max_depth=None):
+        """Return list of datasets in the supply chain of ``node``, up to ``max_depth`` steps away."""
+        return [self.data[i] for i in self.bfs(node, "upstream", max_depth)]
+
+    def downstream(self, node, max_depth=None):
+        """Return list of datasets which use ``node``, directly or indirectly, up to ``max_depth`` steps away."""
+        return [self.data[i] for i in self.bfs(node, "downstream", max_depth)]
+
+    def providers(self, node):
+        """Return list of datasets which ``node`` uses directly."""
+        return [self.data[i] for i in self.neighbours(node, "upstream")]
+
+    def consumers(self, node):
+        """Return list of datasets which use ``node`` directly."""
+        return [self.data[i] for i in self.neighbours(node, "downstream")]
+
+    def strongly_connected_components(self):
+        """Return list of strongly connected components, each a sorted array of positions.
+
+        Uses an iterative version of Tarjan's algorithm, so deep supply chains don't hit the recursion limit. Components are returned in reverse topological order: providers before their consumers.
+        """
+        # Plain lists are much faster than arrays for element-wise access
+        indptr = self.upstream_indptr.tolist()
+        indices = self.upstream_indices.tolist()
+        size = len(self.data)
+        number = [-1] * size
+        lowlink = [0] * size
+        on_stack = [False] * size
+        stack, components, counter = [], [], 0
+
+        for root in range(size):
+            if number[root] >= 0:
+                continue
+            # Call stack of ``(node, position of next edge to follow)``
+            work = [(root, indptr[root])]
+            number[root] = lowlink[root] = counter
+            counter += 1
+            stack.append(root)
+            on_stack[root] = True
+            while work:
+                i, edge = work[-1]
+                if edge < indptr[i + 1]:
+                    work[-1] = (i, edge + 1)
+                    j = indices[edge]
+                    if number[j] < 0:
+                        number[j] = lowlink[j] = counter
+                        counter += 1
+                        stack.append(j)
+                        on_stack[j] = True
+                        work.append((j, indptr[j]))
+                    elif on_stack[j]:
+                        lowlink[i] = min(lowlink[i], number[j])
+                    continue
+
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    lowlink[parent] = min(lowlink[parent], lowlink[i])
+                if lowlink[i] == number[i]:
+                    component = []
+                    while True:
+                        j = stack.pop()
+                        on_stack[j] = False
+                        component.append(j)
+                        if j == i:
+                            break
+                    components.append(np.sort(np.array(component, dtype=np.int64)))
+        return components
+
+    def cycles(self):
+        """Return list of strongly connected components with more than one node, i.e. the groups of datasets which supply each other."""
+        return [c for c in self.strongly_connected_components() if len(c) > 1]
+
+    def has_cycles(self):
+        """Return ``True`` if any dataset is (indirectly) in its own supply chain."""
+        return bool(self.cycles())
@@ -0,0 +1,466 @@
+"""Indexes over lists of datasets, used to avoid scanning all of ``data`` on every search."""
+from bisect import bisect_left, insort
+
+from wurst.searching import (
+    Contains,
+    DoesntContainAny,
+    Either,
+    Equals,
+    Exclude,
+    Filter,
+    In,
+    StartsWith,
+    plan,
+)
+
+NEGATIVE = (Exclude, DoesntContainAny)
+
+
+def _is_hashable(value):
+    try:
+        hash(value)
+    except TypeError:
+        return False
+    return True
+
+
+def trigrams(string):
+    """Return set of all three character substrings in ``string``"""
+    return {string[i : i + 3] for i in range(len(string) - 2)}
+
+
+class DatasetIndex:
+    """Hash index over the fields of a list of datasets ``data``.
+
+    A ``DatasetIndex`` can be used wherever ``data`` is iterated over. When passed to ``get_many`` or ``get_one``, ``equals`` filters are answered with dictionary lookups, and the remaining filters are only applied to the intersection of the lookup results.
+
+    .. code-block:: python
+
+        index = DatasetIndex(data, substring_fields=["name"])
+        get_one(index, equals("name", "foo"), equals("location", "CH"))
+
+    ``substring_fields`` is an optional list of string fields which also get a trigram index. ``contains`` and ``doesnt_contain_any`` filters on these fields (with search strings of at least three characters) are then answered with set operations on the trigram index, as are ``either`` and ``exclude`` filters built from answerable filters.
+
+    If ``cache_results``, the results of searches made only with ``Filter`` objects are stored, and repeated identical searches are answered from this cache. The cache is keyed by the filter ``key`` values, and emptied whenever ``generation`` changes.
+
+    The index for each field is built the first time that field is searched. Datasets appended to ``data`` are added to the existing indexes automatically. ``generation`` is incremented when datasets are added or removed, and by the ``wurst`` functions which modify datasets (see ``mark_modified``); if you change dataset values in place yourself, call ``touch`` or ``rebuild``.
+    """
+
+    def __init__(self, data, substring_fields=(), cache_results=False):
+        self.data = data
+        self.substring_fields = set(substring_fields)
+        self.cache_results = cache_results
+        self.generation = 0
+        self._results = {}
+        self._indexes = {}
+        self._trigrams = {}
+        self._prefixes = {}
+        self._providers = None
+        self._size = 0
+
+    def __iter__(self):
+        return iter(self.data)
+
+    def __len__(self):
+        return len(self.data)
+
+    def __getitem__(self, key):
+        return self.data[key]
+
+    def append(self, ds):
+        self.data.append(ds)
+
+    def extend(self, datasets):
+        self.data.extend(datasets)
+
+    def rebuild(self):
+        """Drop all field indexes; they will be rebuilt on the next search."""
+        self._indexes = {}
+        self._trigrams = {}
+        self._prefixes = {}
+        self._providers = None
+        self._size = len(self.data)
+        self.touch()
+
+    def touch(self, fields=()):
+        """Record that datasets were modified, invalidating cached results.
+
+        ``fields`` is an optional list of dataset fields whose values were changed; their indexes are dropped and rebuilt on the next search.
+        """
+        self.generation += 1
+        self._results = {}
+        if self._providers is not None:
+            self._providers.touch(fields)
+        for field in fields:
+            for indexes in (self._indexes, self._trigrams, self._prefixes):
+                indexes.pop(field, None)
+
+    def _sync(self):
+        size = len(self.data)
+        if size < self._size:
+            self.rebuild()
+        elif size > self._size:
+            self.touch()
+            new = range(self._size, size)
+            for field in list(self._indexes):
+                self._add_to_index(field, new)
+            for field in list(self._trigrams):
+                self._add_to_trigram_index(field, new)
+            for field in list(self._prefixes):
+                self._add_to_prefix_index(field, new)
+            self._size = size
+
+    def _add_to_index(self, field, positions):
+        index = self._indexes[field]
+        if index is None:
+            return
+        for i in positions:
+            value = self.data[i].get(field)
+            if not _is_hashable(value):
+                # Can't index this field; fall back to scanning
+                self._indexes[field] = None
+                return
+            index.setdefault(value, []).append(i)
+
+    def _add_to_trigram_index(self, field, positions):
+        index = self._trigrams[field]
+        if index is None:
+            return
+        for i in positions:
+            value = self.data[i].get(field)
+            if value is None:
+                continue
+            elif not isinstance(value, str):
+                self._trigrams[field] = None
+                return
+            for gram in trigrams(value):
+                index.setdefault(gram, set()).add(i)
+
+    def _add_to_prefix_index(self, field, positions):
+        index = self._prefixes[field]
+        if index is None:
+            return
+        for i in positions:
+            value = self.data[i].get(field) or ""
+            if not isinstance(value, str):
+                self._prefixes[field] = None
+                return
+            insort(index, (value, i))
+
+    @property
+    def providers(self):
+        """``ProviderIndex`` of ``data``, built on first use, and used by ``relink_technosphere_exchanges`` to find providers."""
+        if self._providers is None:
+            self._providers = ProviderIndex(self.data)
+        return self._providers
+
+    def field_index(self, field):
+        """Return dictionary of ``{value: [positions in data]}`` for ``field``, or ``None`` if ``field`` has unhashable values."""
+        self._sync()
+        if field not in self._indexes:
+            self._indexes[field] = {}
+            self._add_to_index(field, range(len(self.data)))
+        return self._indexes[field]
+
+    def trigram_index(self, field):
+        """Return dictionary of ``{trigram: {positions in data}}`` for ``field``.
+
+        Returns ``None`` if ``field`` isn't in ``substring_fields``, or has values which aren't strings.
+        """
+        if field not in self.substring_fields:
+            return None
+        self._sync()
+        if field not in self._trigrams:
+            self._trigrams[field] = {}
+            self._add_to_trigram_index(field, range(len(self.data)))
+        return self._trigrams[field]
+
+    def prefix_index(self, field):
+        """Return sorted list of ``(value, position in data)`` for ``field``, or ``None`` if ``field`` has values which aren't strings.
+
+        Missing and ``None`` values are indexed as empty strings, as they are matched by ``startswith``.
+        """
+        self._sync()
+        if field not in self._prefixes:
+            index = []
+            for i, ds in enumerate(self.data):
+                value = ds.get(field) or ""
+                if not isinstance(value, str):
+                    index = None
+                    break
+                index.append((value, i))
+            if index is not None:
+                index.sort()
+            self._prefixes[field] = index
+        return self._prefixes[field]
+
+    def lookup(self, field, value):
+        """Return sorted list of positions of datasets whose ``field`` is equal to ``value``.
+
+        Returns ``None`` if the lookup can't be answered by the index."""
+        index = self.field_index(field)
+        if index is None or not _is_hashable(value):
+            return None
+        return index.get(value, [])
+
+    def lookup_substring(self, field, value):
+        """Return set of positions of datasets whose ``field`` contains ``value``.
+
+        Returns ``None`` if the lookup can't be answered by the index."""
+        index = self.trigram_index(field)
+        if index is None or not isinstance(value, str) or len(value) < 3:
+            return None
+        grams = sorted((index.get(gram, set()) for gram in trigrams(value)), key=len)
+        candidates = grams[0].intersection(*grams[1:])
+        # Trigram matches are only candidates; check the actual substring
+        return {i for i in candidates if value in self.data[i][field]}
+
+    def lookup_prefix(self, field, prefix):
+        """Return set of positions of datasets whose ``field`` starts with ``prefix``.
+
+        ``prefix`` can also be a tuple of strings, as in ``str.startswith``. Returns ``None`` if the lookup can't be answered by the index.
+        """
+        index = self.prefix_index(field)
+        if index is None:
+            return None
+        if isinstance(prefix, tuple):
+            found = [self.lookup_prefix(field, p) for p in prefix]
+            if any(positions is None for positions in found):
+                return None
+            return set().union(*found)
+        elif not isinstance(prefix, str):
+            return None
+        positions = set()
+        for j in range(bisect_left(index, (prefix,)), len(index)):
+            value, i = index[j]
+            if not value.startswith(prefix):
+                break
+            positions.add(i)
+        return positions
+
+    def _positions(self, func):
+        """Return set of positions of datasets which pass ``func``, or ``None`` if ``func`` can't be answered by the index."""
+        if isinstance(func, Equals):
+            found = self.lookup(func.field, func.value)
+            return None if found is None else set(found)
+        elif isinstance(func, In):
+            found = [self.lookup(func.field, value) for value in func.values]
+            if any(positions is None for positions in found):
+                return None
+            return {i for positions in found for i in positions}
+        elif isinstance(func, Contains):
+            return self.lookup_substring(func.field, func.value)
+        elif isinstance(func, StartsWith):
+            return self.lookup_prefix(func.field, func.value)
+        elif isinstance(func, Either):
+            found = [self._positions(f) for f in func.funcs]
+            if not found or any(positions is None for positions in found):
+                return None
+            return set().union(*found)
+        elif isinstance(func, NEGATIVE):
+            excluded = self._excluded(func)
+            if excluded is not None:
+                return set(range(len(self.data))).difference(excluded)
+
+    def _excluded(self, func):
+        if isinstance(func, Exclude):
+            return self._positions(func.func)
+        found = [self.lookup_substring(func.field, value) for value in func.values]
+        if any(positions is None for positions in found):
+            return None
+        return set().union(*found)
+
+    def get_many(self, *funcs):
+        """Apply all filter functions ``funcs``, using indexes where possible.
+
+        Index lookups are intersected starting with the smallest result; filters which can't be answered by the index are then applied to the remaining candidates in the order given by ``plan``. Negative filters (``exclude``, ``doesnt_contain_any``) are only answered by the index if nothing else narrows the search, as otherwise it is cheaper to test the remaining candidates directly.
+        """
+        if not (self.cache_results and all(isinstance(f, Filter) for f in funcs)):
+            return (self.data[i] for i in self._search(funcs))
+
+        self._sync()
+        key = frozenset(func.key for func in funcs)
+        if key not in self._results:
+            self._results[key] = list(self._search(funcs))
+        return (self.data[i] for i in self._results[key])
+
+    def _search(self, funcs):
+        """Return iterator of positions of datasets which pass all ``funcs``."""
+        lookups, negative, remaining = [], [], []
+        for func in plan(funcs):
+            if isinstance(func, NEGATIVE):
+                negative.append(func)
+                continue
+            positions = self._positions(func)
+            if positions is None:
+                remaining.append(func)
+            else:
+                lookups.append(positions)
+
+        if not lookups:
+            for func in negative:
+                positions = self._positions(func)
+                if positions is None:
+                    remaining.append(func)
+                else:
+                    lookups.append(positions)
+        else:
+            remaining = negative + remaining
+
+        if not lookups:
+            positions = iter(range(len(self.data)))
+        else:
+            lookups.sort(key=len)
+            positions = iter(sorted(lookups[0].intersection(*lookups[1:])))
+        for func in plan(remaining):
+            positions = filter(lambda i, func=func: func(self.data[i]), positions)
+        return positions
+
+
+class ProviderIndex:
+    """Index of the datasets in ``data`` by ``(name, reference product, unit)``, the key used to find technosphere providers.
+
+    .. code-block:: python
+
+        providers = ProviderIndex(data)
+        for ds in new_datasets:
+            relink_technosphere_exchanges(ds, data, providers=providers)
+
+    Datasets appended to ``data`` are added on the next lookup. If the name, reference product or unit of datasets is changed in place, call ``rebuild``, or ``touch`` with the changed fields.
+    """
+
+    FIELDS = ("name", "reference product", "unit")
+
+    def __init__(self, data):
+        self.data = data
+        self.rebuild()
+
+    def rebuild(self):
+        """Rebuild the index from ``data``."""
+        self._index = {}
+        self._size = 0
+        self._sync()
+
+    def touch(self, fields=()):
+        """Record that datasets were modified; rebuilds the index if any of ``fields`` were changed."""
+        if set(fields).intersection(self.FIELDS):
+            self.rebuild()
+
+    def _sync(self):
+        size = len(self.data)
+        if size < self._size:
+            return self.rebuild()
+        for i in range(self._size, size):
+            ds = self.data[i]
+            key = (ds["name"], ds["reference product"], ds["unit"])
+            self._index.setdefault(key, []).append(ds)
+        self._size = size
+
+    def get(self, key):
+        """Return list of datasets with ``(name, reference product, unit)`` equal to ``key``, in the order of ``data``."""
+        self._sync()
+        return self._index.get(key, [])
+
+    def providers(self, exchange):
+        """Return list of datasets with the same name, reference product and unit as the product of ``exchange``."""
+        return self.get((exchange["name"], exchange["product"], exchange["unit"]))
+
+
+class ConsumerIndex:
+    """Reverse index from provider key to the ``(dataset, exchange)`` pairs which consume it.
+
+    Keys are the values of ``fields`` in exchanges of one of the ``types``; the default ``("name", "product", "unit")`` ignores location, so that all consumers of a product can be found when a new regional provider is added. Add ``"location"`` to ``fields`` to index exact providers.
+
+    .. code-block:: python
+
+        consumers = ConsumerIndex(data)
+        new = copy_to_new_location(ds, "FR", consumers=consumers)
+        for consumer, exc in consumers.consumers(new):
+            ...
+
+    ``copy_to_new_location``, ``relink_technosphere_exchanges`` and ``link_internal`` keep the index up to date when passed as ``consumers``. Otherwise, call ``update`` after changing the exchanges of a dataset in place, or ``sync`` to pick up new, removed and changed datasets in ``data``. A dataset counts as changed if its ``exchanges`` list was replaced or changed length.
+    """
+
+    def __init__(
+        self, data=(), fields=("name", "product", "unit"), types=("technosphere",)
+    ):
+        self.fields = tuple(fields)
+        self.types = set(types)
+        self._consumers = {}
+        self._datasets = {}
+        for ds in data:
+            self.add(ds)
+
+    def __len__(self):
+        return sum(len(pairs) for pairs in self._consumers.values())
+
+    def __contains__(self, ds):
+        return id(ds) in self._datasets
+
+    def key(self, obj):
+        """Return the index key of exchange ``obj``, or of the reference product of dataset ``obj``."""
+        if "exchanges" in obj:
+            # Datasets use ``reference product`` instead of ``product``
+            return tuple(
+                obj.get("reference product" if f == "product" else f)
+                for f in self.fields
+            )
+        return tuple(obj.get(f) for f in self.fields)
+
+    def add(self, ds):
+        """Add the exchanges of dataset ``ds``. Re-indexes ``ds`` if it was already added."""
+        if id(ds) in self._datasets:
+            self.remove(ds)
+        keys = []
+        for exc in ds["exchanges"]:
+            if exc.get("type") in self.types:
+                key = self.key(exc)
+                self._consumers.setdefault(key, {})[id(exc)] = (ds, exc)
+                keys.append((key, id(exc)))
+        self._datasets[id(ds)] = (ds, ds["exchanges"], len(ds["exchanges"]), keys)
+
+    def remove(self, ds):
+        """Remove the exchanges of dataset ``ds``."""
+        _, _, _, keys = self._datasets.pop(id(ds))
+        for key, exc_id in keys:
+            pairs = self._consumers[key]
+            del pairs[exc_id]
+            if not pairs:
+                del self._consumers[key]
+
+    update = add
+
+    def sync(self, data):
+        """Add new and changed datasets in ``data``, and remove datasets which are no longer in ``data``."""
+        present = set()
+        for ds in data:
+            present.add(id(ds))
+            known = self._datasets.get(id(ds))
+            if (
+                known is None
+                or ds["exchanges"] is not known[1]
+                or len(ds["exchanges"]) != known[2]
+            ):
+                self.add(ds)
+        for ds, _, _, _ in [
+            value for key, value in self._datasets.items() if key not in present
+        ]:
+            self.remove(ds)
+
+    def consumers(self, obj):
+        """Return list of ``(dataset, exchange)`` pairs consuming ``obj``.
+
+        ``obj`` can be a provider dataset, an exchange, or a key tuple of ``fields`` values.
+        """
+        key = obj if isinstance(obj, tuple) else self.key(obj)
+        return list(self._consumers.get(key, {}).values())
+
+
+def mark_modified(data, fields=()):
+    """Record that datasets in ``data`` were modified in place.
+
+    Does nothing unless ``data`` is an index like ``DatasetIndex``, in which case cached search results are discarded. ``fields`` is an optional list of dataset fields whose values were changed. Called by the ``wurst`` functions which modify datasets.
+    """
+    touch = getattr(data, "touch", None)
+    if touch is not None:
+        touch(fields)
@@ -1,71 +1,720 @@
+import multiprocessing
+from collections import Counter
+from contextlib import contextmanager, nullcontext
 from pprint import pformat
+from time import perf_counter
 
+import numpy as np
+
+from wurst import logger
 from wurst.errors import InvalidLink, NonuniqueCode
+from wurst.indexing import mark_modified
 from wurst.searching import reference_product
 
 get_input_databases = lambda data: {ds["database"] for ds in data}
 
 
-def link_internal(data, fields=("name", "product", "location", "unit")):
-    """Link internal exchanges by ``fields``. Creates ``input`` field in newly-linked exchanges."""
-    input_databases = get_input_databases(data)
-    get_tuple = lambda exc: tuple([exc[f] for f in fields])
-    products = {
-        get_tuple(reference_product(ds)): (ds["database"], ds["code"]) for ds in data
-    }
+class LinkingReport:
+    """Problems found when linking or checking links, collected instead of raising an error on the first one.
 
-    for ds in data:
-        for exc in ds["exchanges"]:
-            if exc.get("input"):
+    Pass a ``LinkingReport`` as ``report`` to ``link_internal``, ``InternalLinker.link`` or ``check_internal_linking`` to finish the whole pass and record every problem. Problems are grouped by kind and by key:
+
+    * ``unlinked``: Exchanges without a linking activity, keyed by the linking ``fields`` values.
+    * ``biosphere``: Unlinked biosphere exchanges, keyed by the linking ``fields`` values.
+    * ``dangling``: Exchanges linked to a missing activity, keyed by ``input``.
+    * ``duplicate_code``: Datasets whose ``code`` is not unique, keyed by ``code``.
+    * ``normalized``: Not a problem, but exchanges which ``link_internal`` could only link after normalizing their ``fields`` values (see ``normalize_key``), keyed by the original values.
+
+    ``counts[kind][key]`` is the number of exchanges (or datasets) with that problem, and ``examples[kind][key]`` is ``(dataset key, exchange)`` for the first one found.
+
+    .. code-block:: python
+
+        report = LinkingReport()
+        link_internal(data, report=report)
+        check_internal_linking(data, report=report)
+        print(report.summary())
+    """
+
+    KINDS = ("unlinked", "biosphere", "dangling", "duplicate_code", "normalized")
+    PROBLEMS = KINDS[:4]
+
+    def __init__(self):
+        self.counts = {kind: {} for kind in self.KINDS}
+        self.examples = {kind: {} for kind in self.KINDS}
+
+    def add(self, kind, key, exc, ds):
+        counts = self.counts[kind]
+        counts[key] = counts.get(key, 0) + 1
+        if key not in self.examples[kind]:
+            self.examples[kind][key] = ((ds.get("database"), ds.get("code")), exc)
+
+    def total(self, kind=None):
+        """Number of exchanges of ``kind``, or of problem exchanges of all kinds (not including ``normalized``)."""
+        kinds = [kind] if kind else self.PROBLEMS
+        return sum(sum(self.counts[k].values()) for k in kinds)
+
+    def __bool__(self):
+        return any(self.counts[kind] for kind in self.PROBLEMS)
+
+    def summary(self, limit=20):
+        """Human-readable summary, listing the ``limit`` most common keys of each kind."""
+        lines = []
+        for kind in self.KINDS:
+            counts = self.counts[kind]
+            if not counts:
                 continue
+            lines.append(
+                "{}: {} exchanges with {} unique keys".format(
+                    kind, self.total(kind), len(counts)
+                )
+            )
+            for key, count in sorted(counts.items(), key=lambda x: -x[1])[:limit]:
+                lines.append("    {}: {}".format(count, key))
+        return "\n".join(lines)
+
+    def raise_for_problems(self):
+        """Raise the error ``link_internal``, ``check_internal_linking`` or ``check_duplicate_codes`` would have raised, with the summary as message."""
+        if self.counts["biosphere"]:
+            raise ValueError("Unlinked biosphere exchanges:\n" + self.summary())
+        elif self.counts["unlinked"]:
+            raise KeyError("Can't find linking activities:\n" + self.summary())
+        elif self.counts["dangling"]:
+            raise InvalidLink(
+                "Exchanges link to non-existent activities:\n" + self.summary()
+            )
+        elif self.counts["duplicate_code"]:
+            raise NonuniqueCode("Codes seen at least twice:\n" + self.summary())
+
+
+class KeyRegistry:
+    """Interns ``(database, code)`` keys as compact integer ids.
+
+    Exchange ``input`` values are normally tuples of two strings, created separately for each exchange. With a registry, linking functions can store the integer id of the key instead, which uses less memory and is cheaper to hash and compare. Ids start at one, so that linked ``input`` values are always true.
+
+    Database names are stored once, in a symbol table of database handles; each id refers to a handle and a code. Renaming or merging databases with ``rename_databases`` therefore only changes the symbol table, and integer links resolve to the new name without being touched.
+
+    Use ``resolve_links`` to turn integer links back into (shared, interned) tuples before writing, or ``intern_links`` to convert existing tuple links to integers.
+    """
+
+    def __init__(self):
+        self.databases = []
+        self._handles = {}
+        self.ids = {}
+        self.handles = [-1]
+        self.codes = [None]
+
+    def __len__(self):
+        return len(self.codes) - 1
+
+    def get(self, key):
+        """Return the integer id for ``key``, or ``None`` if it isn't registered."""
+        database, code = key
+        for handle in self._handles.get(database, ()):
+            id_ = self.ids.get((handle, code))
+            if id_ is not None:
+                return id_
+
+    def id(self, key):
+        """Return the integer id for ``key``, adding it if needed."""
+        id_ = self.get(key)
+        if id_ is not None:
+            return id_
+        database, code = key
+        handles = self._handles.setdefault(database, [])
+        if not handles:
+            handles.append(len(self.databases))
+            self.databases.append(database)
+        id_ = self.ids[(handles[0], code)] = len(self.codes)
+        self.handles.append(handles[0])
+        self.codes.append(code)
+        return id_
+
+    def key(self, id_):
+        """Return the ``(database, code)`` key for integer id ``id_``."""
+        return (self.databases[self.handles[id_]], self.codes[id_])
+
+    @property
+    def keys(self):
+        """List of the current keys of all ids, starting with ``None`` for id zero."""
+        names = self.databases
+        return [None] + [
+            (names[handle], code)
+            for handle, code in zip(self.handles[1:], self.codes[1:])
+        ]
+
+    def resolve(self, value):
+        """Return ``value`` as a key, whether it is an integer id or already a key."""
+        return self.key(value) if isinstance(value, int) else value
+
+    def database_mask(self, names):
+        """Return boolean array, indexed by id, which is ``True`` for keys whose database is in ``names``."""
+        handles = [h for name in names for h in self._handles.get(name, ())]
+        return np.isin(np.array(self.handles, dtype=np.int64), handles)
+
+    def intern_links(self, data):
+        """Replace tuple ``input`` values in ``data`` with integer ids."""
+        for ds in data:
+            for exc in ds["exchanges"]:
+                if exc.get("input") and not isinstance(exc["input"], int):
+                    exc["input"] = self.id(exc["input"])
+        return data
+
+    def resolve_links(self, data):
+        """Replace integer ``input`` values in ``data`` with ``(database, code)`` tuples."""
+        keys = self.keys
+        for ds in data:
+            for exc in ds["exchanges"]:
+                if isinstance(exc.get("input"), int):
+                    exc["input"] = keys[exc["input"]]
+        return data
+
+    def rename_databases(self, old_names, name):
+        """Change the database of all keys whose database is in ``old_names`` to ``name``.
+
+        Only the symbol table of database names is changed, so this takes time proportional to the number of databases, not keys. Integer links don't change, and will resolve to the new database name.
+        """
+        old_names = set(old_names)
+        for handle, database in enumerate(self.databases):
+            if database in old_names and database != name:
+                self._handles[database].remove(handle)
+                if not self._handles[database]:
+                    del self._handles[database]
+                self.databases[handle] = name
+                self._handles.setdefault(name, []).append(handle)
+
 
-            if exc["type"] == "biosphere":
+class LinkingMetrics:
+    """Counts and timings of linking passes, to find out where linking time goes.
+
+    Pass a ``LinkingMetrics`` as ``metrics`` to ``link_internal``, ``check_internal_linking``, ``add_input_info_for_indigenous_exchanges`` or ``add_input_info_for_external_exchanges``. Each call adds a dictionary to ``passes``, with:
+
+    * ``function``: Name of the function.
+    * ``datasets`` and ``exchanges``: Number of datasets and exchanges scanned.
+    * ``skipped``: Exchanges which weren't looked up, e.g. because they were already linked (or for checks, not linked).
+    * ``hits`` and ``misses``: Lookups which did or didn't find an activity. For ``add_input_info_for_external_exchanges``, misses are cache misses which needed a database query.
+    * ``index_time``: Seconds spent building lookup indexes.
+    * ``wall_time``: Total seconds spent in the call.
+
+    If ``log``, each pass is also logged as a structured event with the ``wurst`` logger.
+
+    .. code-block:: python
+
+        metrics = LinkingMetrics(log=True)
+        link_internal(data, metrics=metrics)
+        check_internal_linking(data, metrics=metrics)
+        print(metrics.summary())
+    """
+
+    FIELDS = (
+        "datasets",
+        "exchanges",
+        "skipped",
+        "hits",
+        "misses",
+        "index_time",
+        "wall_time",
+    )
+
+    def __init__(self, log=False):
+        self.log = log
+        self.passes = []
+
+    @contextmanager
+    def measure(self, function):
+        """Context manager which yields the statistics dictionary of a new pass, and records it with its ``wall_time`` on exit."""
+        stats = dict.fromkeys(self.FIELDS, 0)
+        stats["function"] = function
+        start = perf_counter()
+        yield stats
+        stats["wall_time"] = perf_counter() - start
+        self.passes.append(stats)
+        if self.log:
+            logger.info("Linking pass", **stats)
+
+    def totals(self, function=None):
+        """Sum of all statistics over all passes, or over passes of ``function``."""
+        passes = [p for p in self.passes if function in (None, p["function"])]
+        return {field: sum(p[field] for p in passes) for field in self.FIELDS}
+
+    def summary(self):
+        """Human-readable summary, one line per pass."""
+        return "\n".join(
+            "{function}: {datasets} datasets, {exchanges} exchanges, {hits} hits, "
+            "{misses} misses, {skipped} skipped; index {index_time:.3f}s, "
+            "total {wall_time:.3f}s".format(**p)
+            for p in self.passes
+        )
+
+
+def measure_pass(metrics, function):
+    """Return ``metrics.measure(function)``, or a context yielding a throwaway statistics dictionary if ``metrics`` is ``None``.
+
+    Used by functions with an optional ``metrics`` argument, so the same code records statistics whether or not a ``LinkingMetrics`` is given.
+    """
+    if metrics is None:
+        return nullcontext(dict.fromkeys(LinkingMetrics.FIELDS, 0))
+    return metrics.measure(function)
+
+
+UNIT_ALIASES = {
+    "kg": "kilogram",
+    "kilograms": "kilogram",
+    "g": "gram",
+    "t": "ton",
+    "tonne": "ton",
+    "metric ton": "ton",
+    "kwh": "kilowatt hour",
+    "kilowatt-hour": "kilowatt hour",
+    "mwh": "megawatt hour",
+    "mj": "megajoule",
+    "kj": "kilojoule",
+    "m": "meter",
+    "metre": "meter",
+    "km": "kilometer",
+    "kilometre": "kilometer",
+    "m2": "square meter",
+    "square metre": "square meter",
+    "m3": "cubic meter",
+    "cubic metre": "cubic meter",
+    "m2*year": "square meter-year",
+    "m3*year": "cubic meter-year",
+    "l": "litre",
+    "liter": "litre",
+    "h": "hour",
+    "hours": "hour",
+    "tkm": "ton kilometer",
+    "t*km": "ton kilometer",
+    "metric ton*km": "ton kilometer",
+    "pkm": "person kilometer",
+    "person*km": "person kilometer",
+    "kbq": "kilo becquerel",
+    "p": "unit",
+}
+
+
+def normalize_key(values, fields):
+    """Normalize the ``fields`` values ``values`` for lenient matching.
+
+    Strings are casefolded and runs of whitespace collapsed to single spaces; ``unit`` values are also replaced with their canonical name from ``UNIT_ALIASES``.
+    """
+    normalized = []
+    for field, value in zip(fields, values):
+        if isinstance(value, str):
+            value = " ".join(value.casefold().split())
+            if field == "unit":
+                value = UNIT_ALIASES.get(value, value)
+        normalized.append(value)
+    return tuple(normalized)
+
+
+def _normalized_index(products, fields):
+    """Index ``products`` by normalized key. Keys which normalize to more than one provider map to ``None``."""
+    index = {}
+    for key, value in products.items():
+        key = normalize_key(key, fields)
+        index[key] = None if index.get(key, value) != value else value
+    return index
+
+
+def _link_dataset(ds, find_input, fields, report=None, fallback=None):
+    """Link exchanges in ``ds`` without ``input``, using ``find_input(key)``.
+
+    If ``find_input`` fails and ``fallback`` is given, ``fallback(key)`` is tried next; it returns ``None`` if there is no match.
+
+    Raises an error for the first exchange which can't be linked, or records it in ``report``. Returns the numbers of exchanges which were and weren't linked.
+    """
+    hits = misses = 0
+    for exc in ds["exchanges"]:
+        if exc.get("input"):
+            continue
+
+        if exc["type"] == "biosphere":
+            misses += 1
+            if report is None:
                 raise ValueError(
                     "Unlinked biosphere exchange:\n{}".format(pformat(exc))
                 )
+            report.add("biosphere", tuple([exc.get(f) for f in fields]), exc, ds)
+            continue
 
-            try:
-                exc["input"] = products[get_tuple(exc)]
-            except KeyError:
+        try:
+            exc["input"] = find_input(tuple([exc[f] for f in fields]))
+            hits += 1
+        except KeyError:
+            input_ = fallback(tuple([exc[f] for f in fields])) if fallback else None
+            if input_:
+                exc["input"] = input_
+                hits += 1
+                if report is not None:
+                    report.add("normalized", tuple([exc[f] for f in fields]), exc, ds)
+                continue
+            misses += 1
+            if report is None:
                 raise KeyError(
                     "Can't find linking activity for exchange:\n{}".format(pformat(exc))
                 )
+            report.add("unlinked", tuple([exc.get(f) for f in fields]), exc, ds)
+    return hits, misses
+
+
+# Read-only state shared with forked worker processes in ``link_internal``
+_shared = None
+
+
+def _link_chunk(bounds):
+    """Find links for ``data[start:stop]`` in a worker process, without changing any exchanges.
+
+    Returns lists of ``(dataset index, exchange index, input)`` patches and ``(kind, dataset index, exchange index)`` problems.
+    """
+    data, products, fields, normalized = _shared
+    patches, problems = [], []
+    for i in range(*bounds):
+        for j, exc in enumerate(data[i]["exchanges"]):
+            if exc.get("input"):
+                continue
+            elif exc["type"] == "biosphere":
+                problems.append(("biosphere", i, j))
+                continue
+            key = tuple([exc[f] for f in fields])
+            try:
+                patches.append((i, j, products[key]))
+            except KeyError:
+                input_ = (
+                    normalized.get(normalize_key(key, fields)) if normalized else None
+                )
+                if input_:
+                    patches.append((i, j, input_))
+                    problems.append(("normalized", i, j))
+                else:
+                    problems.append(("unlinked", i, j))
+    return patches, problems
+
+
+def _chunks(data, count):
+    """Split ``data`` into ``count`` contiguous ``(start, stop)`` ranges with similar numbers of exchanges."""
+    sizes = np.cumsum([len(ds["exchanges"]) for ds in data])
+    if not len(sizes):
+        return []
+    cuts = np.searchsorted(sizes, np.linspace(0, sizes[-1], count + 1)[1:-1])
+    bounds = np.unique(np.concatenate([[0], cuts, [len(data)]]))
+    return [(int(a), int(b)) for a, b in zip(bounds[:-1], bounds[1:])]
+
+
+def _link_parallel(data, products, normalized, fields, report, processes):
+    """Link ``data`` in a pool of forked processes. Returns the numbers of exchanges which were and weren't linked, or ``None`` if ``fork`` isn't available."""
+    global _shared
+    try:
+        context = multiprocessing.get_context("fork")
+    except ValueError:
+        # No ``fork`` on this platform; workers couldn't share the index
+        return None
+
+    datasets = list(data)
+    _shared = (datasets, products, fields, normalized)
+    try:
+        with context.Pool(processes) as pool:
+            results = pool.map(_link_chunk, _chunks(datasets, processes * 4))
+    finally:
+        _shared = None
+
+    problems = [problem for _, found in results for problem in found]
+    errors = [problem for problem in problems if problem[0] != "normalized"]
+    if errors and report is None:
+        kind, i, j = errors[0]
+        exc = datasets[i]["exchanges"][j]
+        if kind == "biosphere":
+            raise ValueError("Unlinked biosphere exchange:\n{}".format(pformat(exc)))
+        raise KeyError(
+            "Can't find linking activity for exchange:\n{}".format(pformat(exc))
+        )
+    for kind, i, j in problems if report is not None else ():
+        exc = datasets[i]["exchanges"][j]
+        report.add(kind, tuple([exc.get(f) for f in fields]), exc, datasets[i])
+    for patches, _ in results:
+        for i, j, input_ in patches:
+            datasets[i]["exchanges"][j]["input"] = input_
+    return sum(len(patches) for patches, _ in results), len(errors)
+
+
+def link_internal(
+    data,
+    fields=("name", "product", "location", "unit"),
+    report=None,
+    registry=None,
+    processes=None,
+    normalize=False,
+    consumers=None,
+    metrics=None,
+):
+    """Link internal exchanges by ``fields``. Creates ``input`` field in newly-linked exchanges.
+
+    Raises an error for the first exchange which can't be linked, unless a ``LinkingReport`` is given as ``report``, in which case all problems are recorded there.
+
+    If a ``KeyRegistry`` is given as ``registry``, new ``input`` values are integer ids from the registry instead of ``(database, code)`` tuples.
+
+    If ``normalize``, exchanges without an exact match are looked up again in a second index keyed by ``normalize_key``, so that differences in case, whitespace and unit abbreviations (like ``kg`` and ``kilogram``) don't prevent linking. Normalized keys shared by several providers are ambiguous, and are not linked. Exchanges linked this way are recorded as ``normalized`` in ``report``.
+
+    If a ``ConsumerIndex`` is given as ``consumers``, it is synchronized with ``data`` after linking, so that new and changed datasets are indexed.
+
+    If a ``LinkingMetrics`` is given as ``metrics``, the counts and timings of this pass are recorded there.
+
+    If ``processes`` is greater than one, datasets are split into chunks with similar numbers of exchanges, which are searched by a pool of ``processes`` forked worker processes. Workers share ``data`` and the product index with the parent copy-on-write, and only send back ``(dataset index, exchange index, input)`` patches, which are then applied in the parent. In this mode an error is raised before any exchange is changed. Only worth it for millions of exchanges; on platforms without ``fork``, linking is done in the current process.
+    """
+    with measure_pass(metrics, "link_internal") as stats:
+        start = perf_counter()
+        get_tuple = lambda exc: tuple([exc[f] for f in fields])
+        if registry is None:
+            get_key = lambda ds: (ds["database"], ds["code"])
+        else:
+            get_key = lambda ds: registry.id((ds["database"], ds["code"]))
+        products = {get_tuple(reference_product(ds)): get_key(ds) for ds in data}
+        normalized = _normalized_index(products, fields) if normalize else None
+        fallback = (
+            (lambda key: normalized.get(normalize_key(key, fields)))
+            if normalize
+            else None
+        )
+        stats["index_time"] = perf_counter() - start
+
+        counts = None
+        if processes and processes > 1:
+            counts = _link_parallel(
+                data, products, normalized, fields, report, processes
+            )
+        if counts is None:
+            counts = [0, 0]
+            for ds in data:
+                hits, misses = _link_dataset(
+                    ds, products.__getitem__, fields, report, fallback
+                )
+                counts[0] += hits
+                counts[1] += misses
+        stats["hits"], stats["misses"] = counts
+        stats["datasets"] = len(data)
+        stats["exchanges"] = sum(len(ds["exchanges"]) for ds in data)
+        stats["skipped"] = stats["exchanges"] - stats["hits"] - stats["misses"]
+
+        if consumers is not None:
+            consumers.sync(data)
+    mark_modified(data)
     return data
 
 
-def check_internal_linking(data):
-    """Check that each internal link is to an actual activity"""
-    names = get_input_databases(data)
-    keys = {(ds["database"], ds["code"]) for ds in data}
-    for ds in data:
-        for exc in ds["exchanges"]:
-            if exc.get("input") and exc["input"][0] in names:
-                if exc["input"] not in keys:
-                    raise InvalidLink(
-                        "Exchange links to non-existent activity:\n{}".format(
-                            pformat(exc)
-                        )
-                    )
+class InternalLinker:
+    """Link internal exchanges by ``fields``, keeping the index of reference products between calls.
+
+    ``link_internal`` builds its index of reference products from scratch every time. An ``InternalLinker`` builds it once, and on each call to ``link`` only updates the index and links exchanges for datasets which are new or changed since the last call. A dataset counts as changed if its ``exchanges`` list was replaced or changed length (as done by the ``wurst`` transformation functions), or if it was passed to ``update``.
+
+    .. code-block:: python
+
+        linker = InternalLinker(fields=("name", "product", "location", "unit"))
+        linker.link(data)
+        data.append(copy_to_new_location(ds, "FR"))
+        linker.link(data)  # Only looks at the new dataset
+
+    Linked ``input`` values are taken from the current ``database`` and ``code`` of the provider, so changing the database name between calls is fine. Exchanges which already have an ``input`` are not changed.
+    """
+
+    def __init__(self, fields=("name", "product", "location", "unit")):
+        self.fields = fields
+        self.products = {}
+        self._datasets = {}
+        self._dirty = {}
+
+    def _key(self, obj):
+        return tuple([obj[f] for f in self.fields])
 
+    def add(self, ds):
+        """Add dataset ``ds`` to the index of reference products.
 
-def change_db_name(data, name):
+        Several datasets can provide the same key; as in ``link_internal``, the one added last is linked to.
+        """
+        key = self._key(reference_product(ds))
+        self.products.setdefault(key, []).append(ds)
+        self._datasets[id(ds)] = (ds, key, ds["exchanges"], len(ds["exchanges"]))
+        self._dirty[id(ds)] = ds
+
+    def remove(self, ds):
+        """Remove dataset ``ds`` from the index of reference products.
+
+        Exchanges already linked to ``ds`` are not changed; use ``check_internal_linking`` to find them.
+        """
+        _, key, _, _ = self._datasets.pop(id(ds))
+        providers = [obj for obj in self.products[key] if obj is not ds]
+        if providers:
+            self.products[key] = providers
+        else:
+            del self.products[key]
+        self._dirty.pop(id(ds), None)
+
+    def update(self, ds, exchanges=None):
+        """Re-index ``ds`` after it was changed in place, e.g. renamed.
+
+        ``exchanges`` is an optional list of exchanges in ``ds`` whose ``input`` should be dropped, so that they are linked again.
+        """
+        if id(ds) in self._datasets:
+            self.remove(ds)
+        for exc in exchanges or []:
+            exc.pop("input", None)
+        self.add(ds)
+
+    def _is_changed(self, ds):
+        _, _, exchanges, length = self._datasets[id(ds)]
+        return ds["exchanges"] is not exchanges or len(exchanges) != length
+
+    def _find_input(self, key):
+        provider = self.products[key][-1]
+        return (provider["database"], provider["code"])
+
+    def link(self, data, report=None):
+        """Link exchanges in new or changed datasets in ``data``. Datasets which are no longer in ``data`` are removed from the index.
+
+        Raises the same errors as ``link_internal``, unless a ``LinkingReport`` is given as ``report``. Datasets with exchanges which couldn't be linked stay in the queue, and are linked again on the next call. Returns ``data``.
+        """
+        present = set()
+        for ds in data:
+            present.add(id(ds))
+            if id(ds) not in self._datasets or self._is_changed(ds):
+                self.update(ds)
+        for ds, _, _, _ in [
+            value for key, value in self._datasets.items() if key not in present
+        ]:
+            self.remove(ds)
+
+        for key, ds in list(self._dirty.items()):
+            _, misses = _link_dataset(ds, self._find_input, self.fields, report)
+            # Datasets with unlinked exchanges are retried on the next call
+            if not misses:
+                del self._dirty[key]
+        mark_modified(data)
+        return data
+
+
+def check_internal_linking(data, report=None, registry=None, metrics=None):
+    """Check that each internal link is to an actual activity.
+
+    Raises ``InvalidLink`` for the first invalid link, unless a ``LinkingReport`` is given as ``report``, in which case all invalid links are recorded there.
+
+    Integer ``input`` values are checked against the ``KeyRegistry`` given as ``registry``. If a ``LinkingMetrics`` is given as ``metrics``, the counts and timings of this pass are recorded there.
+    """
+    with measure_pass(metrics, "check_internal_linking") as stats:
+        start = perf_counter()
+        names = get_input_databases(data)
+        keys = {(ds["database"], ds["code"]) for ds in data}
+        if registry is not None:
+            ids = {registry.get(key) for key in keys}
+        stats["index_time"] = perf_counter() - start
+
+        hits = misses = exchanges = 0
+        for ds in data:
+            exchanges += len(ds["exchanges"])
+            for exc in ds["exchanges"]:
+                if isinstance(exc.get("input"), int):
+                    key = registry.key(exc["input"])
+                    internal = key[0] in names
+                    invalid = internal and exc["input"] not in ids
+                else:
+                    key = exc.get("input")
+                    internal = key and key[0] in names
+                    invalid = internal and key not in keys
+                if not internal:
+                    continue
+                elif not invalid:
+                    hits += 1
+                    continue
+                misses += 1
+                if report is not None:
+                    report.add("dangling", key, exc, ds)
+                    continue
+                raise InvalidLink(
+                    "Exchange links to non-existent activity:\n{}".format(pformat(exc))
+                )
+        stats.update(
+            datasets=len(data),
+            exchanges=exchanges,
+            hits=hits,
+            misses=misses,
+            skipped=exchanges - hits - misses,
+        )
+
+
+def change_db_name(data, name, registry=None):
     """Change the database of all datasets in ``data`` to ``name``.
 
+    If a ``KeyRegistry`` is given as ``registry``, integer ``input`` values are not changed; instead, the database names in the registry are renamed, which doesn't depend on the number of keys. Tuple ``input`` values on the old database names are replaced by ids of their new keys, so that no link is left on an old name.
+
     Raises errors if each dataset does not have exactly one reference production exchange.
     """
     old_names = get_input_databases(data)
+    if registry is not None:
+        registry.rename_databases(old_names, name)
     for ds in data:
         ds["database"] = name
         for exc in ds["exchanges"]:
-            if exc.get("input") and exc["input"][0] in old_names:
-                exc["input"] = (name, exc["input"][1])
+            if isinstance(exc.get("input"), int):
+                continue
+            elif exc.get("input") and exc["input"][0] in old_names:
+                key = (name, exc["input"][1])
+                exc["input"] = key if registry is None else registry.id(key)
+    mark_modified(data, ["database"])
     return data
 
 
+def _duplicate_codes(data):
+    counts = Counter(ds["code"] for ds in data)
+    return {code for code, count in counts.items() if count > 1}
+
+
 def check_duplicate_codes(data):
     """Check that there won't be duplicate codes when activities are merged to new, common database"""
-    seen = set()
-    for ds in data:
-        if ds["code"] in seen:
-            raise NonuniqueCode("Code {} seen at least twice".format(ds["code"]))
-        seen.add(ds["code"])
+    duplicates = _duplicate_codes(data)
+    if duplicates:
+        raise NonuniqueCode(
+            "Code {} seen at least twice".format(
+                ", ".join(sorted(map(str, duplicates)))
+            )
+        )
+
+
+def validate_links(data, report=None, registry=None, unique=None):
+    """Check internal links and dataset codes in ``data`` in one pass, finding every problem.
+
+    Does the checks of ``check_internal_linking`` and ``check_duplicate_codes`` with set and array operations on the unique link targets, instead of checking each exchange: tuple targets are compared with the set of dataset keys, and integer targets with the dataset ids in the ``KeyRegistry`` given as ``registry`` using ``np.isin``. Exchanges are only visited again to report the dangling links found.
+
+    Codes are checked for duplicates among the datasets in ``unique``, or in ``data`` if not given.
+
+    Problems are recorded in ``report``, or a new ``LinkingReport``, which is returned. Call ``raise_for_problems`` on the result to raise an error if there are any.
+    """
+    report = LinkingReport() if report is None else report
+    names = get_input_databases(data)
+    keys = {(ds["database"], ds["code"]) for ds in data}
+
+    targets = {exc.get("input") for ds in data for exc in ds["exchanges"]}
+    dangling = {
+        value
+        for value in targets - keys
+        if value and not isinstance(value, int) and value[0] in names
+    }
+    ids = [value for value in targets if isinstance(value, int)]
+    if ids:
+        ids = np.array(ids, dtype=np.int64)
+        dataset_ids = np.array(
+            [id_ for id_ in map(registry.get, keys) if id_ is not None],
+            dtype=np.int64,
+        )
+        internal = registry.database_mask(names)[ids]
+        dangling.update(ids[internal & ~np.isin(ids, dataset_ids)].tolist())
+
+    for ds in data if dangling else ():
+        for exc in ds["exchanges"]:
+            key = exc.get("input")
+            if key in dangling:
+                key = registry.key(key) if isinstance(key, int) else key
+                report.add("dangling", key, exc, ds)
+
+    unique = data if unique is None else unique
+    duplicates = _duplicate_codes(unique)
+    for ds in unique:
+        if ds["code"] in duplicates:
+            report.add("duplicate_code", ds["code"], None, ds)
+    return report
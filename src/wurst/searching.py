@@ -1,57 +1,422 @@
+from contextlib import contextmanager
+from itertools import islice
+
+import numpy as np
+
 from wurst.errors import MultipleResults, NoResults
 
+# Active exchange partition cache, if any; see ``exchange_cache``
+_exchange_cache = None
+
+
+class Filter:
+    """Base class for filter functions which record what they test.
+
+    Filters are called with a dataset (or exchange) and return ``True`` or ``False``, so they can be used exactly like plain filter functions. Because the ``field``, operator and value(s) are known, ``get_many`` can order filters by cost, and indexes can answer them without calling them on every dataset.
+
+    ``cost`` is a rough relative evaluation cost, used by ``plan``."""
+
+    op = None
+    cost = 1
+
+    def __call__(self, x):
+        raise NotImplementedError
+
+    @property
+    def key(self):
+        """Hashable description of this filter."""
+        raise NotImplementedError
+
+    def __repr__(self):
+        # Built from the raw arguments; ``key`` holds their hashable forms
+        value = self.values if hasattr(self, "values") else self.value
+        return "{}({!r}, {!r})".format(self.op, self.field, value)
+
+
+class Equals(Filter):
+    """Filter where input ``field`` value is equal to ``value``"""
+
+    op = "equals"
+    cost = 0
+
+    def __init__(self, field, value):
+        self.field = field
+        self.value = value
+
+    def __call__(self, x):
+        return x.get(self.field) == self.value
+
+    @property
+    def key(self):
+        return (self.op, self.field, _freeze(self.value))
+
+
+class In(Filter):
+    """Filter where input ``field`` value is one of ``values``"""
+
+    op = "one_of"
+    cost = 0
+
+    def __init__(self, field, values):
+        self.field = field
+        self.values = tuple(values)
+        try:
+            self._lookup = frozenset(self.values)
+        except TypeError:
+            self._lookup = self.values
+
+    def __call__(self, x):
+        try:
+            return x.get(self.field) in self._lookup
+        except TypeError:
+            return x.get(self.field) in self.values
+
+    @property
+    def key(self):
+        return (self.op, self.field, tuple(_freeze(v) for v in self.values))
+
+
+class Contains(Filter):
+    """Filter where input ``field`` value contains ``value``"""
+
+    op = "contains"
+    cost = 2
+
+    def __init__(self, field, value):
+        self.field = field
+        self.value = value
+
+    def __call__(self, x):
+        value = x.get(self.field)
+        return value is not None and self.value in value
+
+    @property
+    def key(self):
+        return (self.op, self.field, _freeze(self.value))
+
+
+class StartsWith(Filter):
+    """Filter where input ``field`` value starts with ``value``"""
+
+    op = "startswith"
+    cost = 1
+
+    def __init__(self, field, value):
+        self.field = field
+        self.value = value
+
+    def __call__(self, x):
+        return (x.get(self.field) or "").startswith(self.value)
+
+    @property
+    def key(self):
+        return (self.op, self.field, self.value)
+
+
+class Either(Filter):
+    """Filter where any of ``funcs`` evaluate true"""
+
+    op = "either"
+
+    def __init__(self, *funcs):
+        self.funcs = funcs
+        self.cost = sum(_cost(f) for f in funcs)
+
+    def __call__(self, x):
+        return any(f(x) for f in self.funcs)
+
+    @property
+    def key(self):
+        return (self.op,) + tuple(_key(f) for f in self.funcs)
+
+    def __repr__(self):
+        return "either({})".format(", ".join(repr(f) for f in self.funcs))
+
+
+class Exclude(Filter):
+    """Filter which returns the opposite of ``func``"""
+
+    op = "exclude"
+
+    def __init__(self, func):
+        self.func = func
+        self.cost = _cost(func)
+
+    def __call__(self, x):
+        return not self.func(x)
+
+    @property
+    def key(self):
+        return (self.op, _key(self.func))
+
+    def __repr__(self):
+        return "exclude({!r})".format(self.func)
+
+
+class DoesntContainAny(Filter):
+    """Filter where input ``field`` value doesn't contain any of ``values``"""
+
+    op = "doesnt_contain_any"
+
+    def __init__(self, field, values):
+        self.field = field
+        self.values = tuple(values)
+        self.cost = 2 * len(self.values)
+
+    def __call__(self, x):
+        value = x.get(self.field)
+        return value is None or not any(v in value for v in self.values)
+
+    @property
+    def key(self):
+        return (self.op, self.field, self.values)
+
+
+def _freeze(value):
+    """Return hashable version of ``value`` for filter keys.
+
+    Containers are tagged with their type, so that e.g. ``[1]`` and ``(1,)``, which aren't equal, get different keys.
+    """
+    if isinstance(value, (list, tuple)):
+        return (type(value).__name__, tuple(_freeze(v) for v in value))
+    elif isinstance(value, dict):
+        return ("dict", tuple(sorted((k, _freeze(v)) for k, v in value.items())))
+    elif isinstance(value, (set, frozenset)):
+        return ("set", frozenset(value))
+    return value
+
+
+def _cost(func):
+    """Plain functions can't be inspected; assume they are expensive."""
+    return func.cost if isinstance(func, Filter) else float("inf")
+
+
+def _key(func):
+    return func.key if isinstance(func, Filter) else func
+
 
 def equals(field, value):
     """Return function where input ``field`` value is equal to ``value``"""
-    return lambda x: x.get(field) == value
+    return Equals(field, value)
 
 
 def contains(field, value):
-    return lambda x: value in x.get(field)
+    """Return function where input ``field`` value contains ``value``"""
+    return Contains(field, value)
 
 
 def startswith(field, value):
-    return lambda x: x.get(field, "").startswith(value)
+    """Return function where input ``field`` value starts with ``value``"""
+    return StartsWith(field, value)
 
 
 def either(*funcs):
     """Return ``True`` is any of the function evaluate true"""
-    return lambda x: any(f(x) for f in funcs)
+    return Either(*funcs)
 
 
 def exclude(func):
     """Return the opposite of ``func`` (i.e. ``False`` instead of ``True``)"""
-    return lambda x: not func(x)
+    return Exclude(func)
 
 
 def doesnt_contain_any(field, values):
     """Exclude all dataset whose ``field`` contains any of ``values``"""
-    return lambda x: all(exclude(contains(field, value))(x) for value in values)
+    return DoesntContainAny(field, values)
+
+
+def simplify(func):
+    """Rewrite ``either`` filters of ``equals`` tests on a single field as one set membership test."""
+    if not isinstance(func, Either):
+        return func
+    funcs = [simplify(f) for f in func.funcs]
+    if funcs and all(isinstance(f, (Equals, In)) for f in funcs):
+        if len({f.field for f in funcs}) == 1:
+            values = [
+                v for f in funcs for v in (f.values if isinstance(f, In) else [f.value])
+            ]
+            return In(funcs[0].field, values)
+    return Either(*funcs)
 
 
-def get_many(data, *funcs):
-    """Apply all filter functions ``funcs`` to ``data``"""
-    for fltr in funcs:
-        data = filter(fltr, data)
-    return data
+def plan(funcs):
+    """Order filter functions ``funcs`` so that cheap and selective tests run first.
+
+    ``Filter`` objects are sorted by ``cost``; plain functions can't be inspected, and are applied last, in their original order. ``None`` is treated as in ``filter``, i.e. only checks truthiness.
+
+    Returns a list of filter functions."""
+    funcs = [bool if func is None else simplify(func) for func in funcs]
+    return sorted(funcs, key=_cost)
+
+
+def get_many(data, *funcs, limit=None):
+    """Apply all filter functions ``funcs`` to ``data``.
+
+    Filters are applied in the order given by ``plan``. If ``data`` provides its own ``get_many`` method (e.g. ``wurst.indexing.DatasetIndex``), the search is delegated to it.
+
+    Results are generated lazily; if ``limit`` is given, the search stops after ``limit`` results.
+    """
+    if hasattr(data, "get_many"):
+        results = data.get_many(*funcs)
+    else:
+        results = data
+        for fltr in plan(funcs):
+            results = filter(fltr, results)
+    if limit is not None:
+        return islice(results, limit)
+    return results
+
+
+class SearchDescription:
+    """Description of a failed search, used as the message of ``NoResults`` and ``MultipleResults``.
+
+    For searches without results, reports how many datasets would match if each filter was left out in turn. This is only computed when the message is shown, so catching these errors stays cheap.
+    """
+
+    def __init__(self, message, data, funcs):
+        self.message = message
+        self.data = data
+        self.funcs = funcs
+
+    def __str__(self):
+        lines = ["{} for filters: {}".format(self.message, list(self.funcs))]
+        # Can't search the data again if it was a (consumed) iterator
+        if self.message == "No results" and len(self.funcs) > 1:
+            if iter(self.data) is not self.data:
+                for i, func in enumerate(self.funcs):
+                    others = self.funcs[:i] + self.funcs[i + 1 :]
+                    count = sum(1 for _ in get_many(self.data, *others))
+                    lines.append("    without {!r}: {} result(s)".format(func, count))
+        return "\n".join(lines)
 
 
 def get_one(data, *funcs):
     """Apply filter functions ``funcs`` to ``data``, and return exactly one result.
 
-    Raises ``wurst.errors.NoResults`` or ``wurst.errors.MultipleResults`` if zero or multiple results are returned.
+    The search stops as soon as a second result is found.
+
+    Raises ``wurst.errors.NoResults`` or ``wurst.errors.MultipleResults`` if zero or multiple results are returned. The error message lists the filters and, if there are no results, the number of near matches.
     """
-    results = list(get_many(data, *funcs))
+    results = list(get_many(data, *funcs, limit=2))
     if not results:
-        raise NoResults
+        raise NoResults(SearchDescription("No results", data, funcs))
     if not len(results) == 1:
-        raise MultipleResults
+        raise MultipleResults(SearchDescription("At least two results", data, funcs))
     return results[0]
 
 
+def get_first(data, *funcs):
+    """Apply filter functions ``funcs`` to ``data``, and return the first result.
+
+    The search stops at the first result.
+
+    Raises ``wurst.errors.NoResults`` if there are no results.
+    """
+    for result in get_many(data, *funcs, limit=1):
+        return result
+    raise NoResults(SearchDescription("No results", data, funcs))
+
+
+def classify(data, filter_sets):
+    """Apply several lists of filter functions to ``data`` in a single pass.
+
+    ``filter_sets`` is a dictionary of ``{label: [filter functions]}``. Filters which appear in several lists (the same function object, or ``Filter`` objects with the same ``key``) are only evaluated once per dataset.
+
+    If ``data`` provides its own ``get_many`` method, each list of filters is passed to it instead, as indexes can answer these searches without a full pass.
+
+    Returns a dictionary of ``{label: [matching datasets]}``.
+
+    .. code-block:: python
+
+        from wurst.ecoinvent.filters import electricity_technologies
+
+        classify(data, electricity_technologies)
+
+    """
+    if hasattr(data, "get_many"):
+        return {
+            label: list(data.get_many(*funcs)) for label, funcs in filter_sets.items()
+        }
+
+    planned = [
+        (label, [(_key(func), func) for func in plan(funcs)])
+        for label, funcs in filter_sets.items()
+    ]
+    results = {label: [] for label in filter_sets}
+    for ds in data:
+        seen = {}
+        for label, funcs in planned:
+            for key, func in funcs:
+                try:
+                    passed = seen[key]
+                except KeyError:
+                    passed = seen[key] = bool(func(ds))
+                if not passed:
+                    break
+            else:
+                results[label].append(ds)
+    return results
+
+
+class _ExchangePartition:
+    """Exchanges of one dataset grouped by type, plus the memoized reference product."""
+
+    def __init__(self, ds):
+        self.ds = ds
+        self.exchanges = ds["exchanges"]
+        self.length = len(self.exchanges)
+        self.by_type = {}
+        for exc in self.exchanges:
+            self.by_type.setdefault(exc["type"], []).append(exc)
+        self.reference_product = None
+
+    def is_valid(self):
+        return (
+            self.ds["exchanges"] is self.exchanges
+            and len(self.exchanges) == self.length
+        )
+
+
+@contextmanager
+def exchange_cache():
+    """Context manager which caches the exchanges of each dataset grouped by type.
+
+    Within this context, ``technosphere``, ``biosphere``, ``production`` and ``reference_product`` only scan the exchanges of a dataset the first time they are called, which helps when they are called repeatedly on the same datasets.
+
+    The cache for a dataset is discarded whenever ``ds["exchanges"]`` is replaced or changes length, which covers all the ``wurst`` transformation functions. If you change exchange types or production amounts in place yourself, call ``invalidate_exchange_cache``.
+
+    .. code-block:: python
+
+        with exchange_cache():
+            for ds in data:
+                change_exchanges_by_constant_factor(ds, 0.9)
+    """
+    global _exchange_cache
+    previous, _exchange_cache = _exchange_cache, {}
+    try:
+        yield
+    finally:
+        _exchange_cache = previous
+
+
+def invalidate_exchange_cache(ds):
+    """Discard cached exchange partitions for ``ds``."""
+    if _exchange_cache is not None:
+        _exchange_cache.pop(id(ds), None)
+
+
+def _partition(ds):
+    partition = _exchange_cache.get(id(ds))
+    if partition is None or not partition.is_valid():
+        partition = _exchange_cache[id(ds)] = _ExchangePartition(ds)
+    return partition
+
+
 def _exchanges(ds, kind, *funcs):
     if funcs == [None]:
         funcs = []
+    if _exchange_cache is not None:
+        return get_many(iter(_partition(ds).by_type.get(kind, [])), *funcs)
     return get_many(filter(lambda x: x["type"] == kind, ds["exchanges"]), *funcs)
 
 
@@ -74,10 +439,21 @@ def reference_product(ds):
     """Get single reference product exchange from a dataset.
 
     Raises ``wurst.errors.NoResults`` or ``wurst.errors.MultipleResults`` if zero or multiple results are returned.
+
+    The result is memoized within an ``exchange_cache`` context.
     """
-    excs = [
-        exc for exc in ds["exchanges"] if exc["amount"] and exc["type"] == "production"
-    ]
+    if _exchange_cache is not None:
+        partition = _partition(ds)
+        if partition.reference_product is None:
+            partition.reference_product = _reference_product(
+                partition.by_type.get("production", [])
+            )
+        return partition.reference_product
+    return _reference_product(ds["exchanges"])
+
+
+def _reference_product(exchanges):
+    excs = [exc for exc in exchanges if exc["amount"] and exc["type"] == "production"]
     if any(exc.get("functional") for exc in excs):
         excs = [exc for exc in excs if exc.get("functional")]
     if not excs:
@@ -87,17 +463,55 @@ def reference_product(ds):
     return excs[0]
 
 
+class LocationRanking:
+    """Location preference order compiled once, for picking best geographic matches in many groups of datasets.
+
+    ``ordered_locations`` is a list of locations in sorting order."""
+
+    def __init__(self, ordered_locations):
+        self.ranks = {y: x for x, y in enumerate(ordered_locations)}
+
+    def best(self, possibles):
+        """Return the element of ``possibles`` with the best ranked location, or ``None``."""
+        ranks = self.ranks
+        best, best_rank = None, None
+        for obj in possibles:
+            rank = ranks.get(obj["location"])
+            if rank is not None and (best_rank is None or rank < best_rank):
+                best, best_rank = obj, rank
+        return best
+
+
 def best_geo_match(possibles, ordered_locations):
     """Pick the dataset from ``possibles`` whose location is first in ``ordered_locations``.
 
     ``possibles`` is an interable with the field ``location``.
 
-    ``ordered_locations`` is a list of locations in sorting order.
+    ``ordered_locations`` is a list of locations in sorting order, or a ``LocationRanking``.
 
     Returns an element from ``possibles``, or ``None``.
     """
-    weights = {y: x for x, y in enumerate(ordered_locations)}
-    filtered = (obj for obj in possibles if obj["location"] in weights)
-    ordered = sorted(filtered, key=lambda x: weights[x["location"]])
-    if ordered:
-        return ordered[0]
+    if not isinstance(ordered_locations, LocationRanking):
+        ordered_locations = LocationRanking(ordered_locations)
+    return ordered_locations.best(possibles)
+
+
+def best_geo_matches(groups, ordered_locations, return_ranks=False):
+    """Apply ``best_geo_match`` to each group of datasets in ``groups``, compiling ``ordered_locations`` only once.
+
+    ``groups`` is an iterable of iterables with the field ``location``.
+
+    ``ordered_locations`` is a list of locations in sorting order, or a ``LocationRanking``.
+
+    Returns a list with an element of each group or ``None``. If ``return_ranks``, also returns a NumPy array with the rank of each match, or -1 where there was no match.
+    """
+    if not isinstance(ordered_locations, LocationRanking):
+        ordered_locations = LocationRanking(ordered_locations)
+    ranks = ordered_locations.ranks
+    matches = [ordered_locations.best(group) for group in groups]
+    if return_ranks:
+        return matches, np.array(
+            [-1 if obj is None else ranks[obj["location"]] for obj in matches],
+            dtype=np.int64,
+        )
+    return matches
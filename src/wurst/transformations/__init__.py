@@ -7,5 +7,6 @@ from wurst.transformations.geo import (
     copy_to_new_location,
     default_global_location,
     relink_technosphere_exchanges,
+    relink_technosphere_exchanges_many,
 )
 from wurst.transformations.uncertainty import rescale_exchange
@@ -1,3 +1,6 @@
+from wurst.indexing import mark_modified
+
+
 def delete_zero_amount_exchanges(data, drop_types=None):
     """Drop all zero value exchanges from a list of datasets.
 
@@ -10,6 +13,7 @@ def delete_zero_amount_exchanges(data, drop_types=None):
         dont_delete = lambda x: x["amount"]
     for ds in data:
         ds["exchanges"] = list(filter(dont_delete, ds["exchanges"]))
+    mark_modified(data)
     return data
 
 
@@ -49,6 +53,7 @@ def add_metadata_to_production_exchanges(
             for field in fields:
                 if field not in exc and field in partner:
                     exc[field] = partner[field]
+    mark_modified(data)
     return data
 
 
@@ -57,4 +62,5 @@ def remove_exchange_fields_with_nones(data):
     clean = lambda dct: {k: v for k, v in dct.items() if v is not None}
     for ds in data:
         ds["exchanges"] = [clean(exc) for exc in ds["exchanges"]]
+    mark_modified(data)
     return data
@@ -1,20 +1,26 @@
-from copy import deepcopy
+from functools import lru_cache
 
+import numpy as np
 from constructive_geometries import resolved_row
 
 from wurst import log
 from wurst.errors import InvalidLink
-from wurst.geo import geomatcher
+from wurst.geo import geomatcher, topology
+from wurst.indexing import ProviderIndex, mark_modified
 from wurst.searching import equals, get_many, get_one, reference_product
 from wurst.transformations.uncertainty import rescale_exchange
-from wurst.transformations.utils import copy_dataset
+from wurst.transformations.utils import clone_exchange, copy_dataset
 
+GEO_CACHE_SIZE = 65536
 
-def copy_to_new_location(ds, location):
+
+def copy_to_new_location(ds, location, consumers=None):
     """Copy dataset and substitute new ``location``.
 
     Doesn't change exchange locations, except for production exchanges.
 
+    If a ``ConsumerIndex`` is given as ``consumers``, the exchanges of the new dataset are added to it.
+
     Returns the new dataset."""
     MESSAGE = "Copied activity from '{old}' location to '{new}'."
     log(
@@ -31,17 +37,26 @@ def copy_to_new_location(ds, location):
         if exc["type"] == "production":
             exc["location"] = location
 
+    if consumers is not None:
+        consumers.add(cp)
     return cp
 
 
 def relink_technosphere_exchanges(
-    ds, data, exclusive=True, drop_invalid=False, biggest_first=False, contained=True
+    ds,
+    data,
+    exclusive=True,
+    drop_invalid=False,
+    biggest_first=False,
+    contained=True,
+    consumers=None,
+    providers=None,
 ):
     """Find new technosphere providers based on the location of the dataset.
 
     Designed to be used when the dataset's location changes, or when new datasets are added.
 
-    Uses the name, reference product, and unit of the exchange to filter possible inputs. These must match exactly. Searches in the list of datasets ``data``.
+    Uses the name, reference product, and unit of the exchange to filter possible inputs. These must match exactly. Searches in the list of datasets ``data``, using a ``ProviderIndex``; pass one as ``providers`` to reuse it over many calls, otherwise it is built for each call (or taken from ``data.providers`` if ``data`` is a ``DatasetIndex``).
 
     Will only search for providers contained within the location of ``ds``, unless ``contained`` is set to ``False``, all providers whose location intersects the location of ``ds`` will be used.
 
@@ -59,46 +74,74 @@ def relink_technosphere_exchanges(
         * ``drop_invalid``: Bool, default is ``False``. Delete exchanges for which no valid provider is available.
         * ``biggest_first``: Bool, default is ``False``. Determines search order when selecting provider locations. Only relevant is ``exclusive`` is ``True``.
         * ``contained``: Bool, default is ``True``. If ture, only use providers whose location is completely within the ``ds`` location; otherwise use all intersecting locations.
+        * ``consumers``: Optional ``ConsumerIndex``, which is updated with the new exchanges of ``ds``.
+        * ``providers``: Optional ``ProviderIndex`` of ``data``.
 
     Modifies the dataset in place; returns the modified dataset."""
-    MESSAGE = "Relinked technosphere exchange of {}/{}/{} from {}/{} to {}/{}."
-    DROPPED = "Dropped technosphere exchange of {}/{}/{}; no valid providers."
-    new_exchanges = []
-    technosphere = lambda x: x["type"] == "technosphere"
-
-    for exc in filter(technosphere, ds["exchanges"]):
-        possible_datasets = list(get_possibles(exc, data))
-        possible_locations = [obj["location"] for obj in possible_datasets]
-        with resolved_row(possible_locations, geomatcher) as g:
-            func = g.contained if contained else g.intersects
-            gis_match = func(
-                ds["location"],
-                include_self=True,
-                exclusive=exclusive,
-                biggest_first=biggest_first,
-                only=possible_locations,
-            )
+    relink_technosphere_exchanges_many(
+        [ds],
+        data,
+        exclusive=exclusive,
+        drop_invalid=drop_invalid,
+        biggest_first=biggest_first,
+        contained=contained,
+        consumers=consumers,
+        providers=providers,
+    )
+    return ds
 
-        kept = [
-            ds for loc in gis_match for ds in possible_datasets if ds["location"] == loc
-        ]
 
-        if kept:
-            missing_faces = geomatcher[ds["location"]].difference(
-                set.union(*[geomatcher[obj["location"]] for obj in kept])
-            )
-            if missing_faces and "RoW" in possible_locations:
-                kept.extend(
-                    [obj for obj in possible_datasets if obj["location"] == "RoW"]
-                )
-        elif "RoW" in possible_locations:
-            kept = [obj for obj in possible_datasets if obj["location"] == "RoW"]
+def relink_technosphere_exchanges_many(
+    datasets,
+    data,
+    exclusive=True,
+    drop_invalid=False,
+    biggest_first=False,
+    contained=True,
+    consumers=None,
+    providers=None,
+):
+    """Relink the technosphere exchanges of each dataset in ``datasets``, as ``relink_technosphere_exchanges`` does, with the same arguments.
+
+    Providers are looked up in one shared ``ProviderIndex``. The exchanges of all datasets are then grouped by the location of their dataset and the locations of their possible providers, and the geographic selection of providers (``provider_locations``) is done once per group; e.g. when a whole sector is copied to a new location with ``copy_to_new_location``, most exchanges share a handful of groups. Answers are also cached between calls (see ``provider_locations``). Finally, the new exchanges of all datasets are applied together.
 
-        if not kept and "GLO" in possible_locations:
-            kept = [obj for obj in possible_datasets if obj["location"] == "GLO"]
+    If an exchange has no valid provider and ``drop_invalid`` is ``False``, ``InvalidLink`` is raised before any dataset is changed.
 
-        if not kept:
-            if drop_invalid:
+    Modifies the datasets in place; returns ``datasets``."""
+    MESSAGE = "Relinked technosphere exchange of {}/{}/{} from {}/{} to {}/{}."
+    DROPPED = "Dropped technosphere exchange of {}/{}/{}; no valid providers."
+    if providers is None:
+        providers = getattr(data, "providers", None) or ProviderIndex(data)
+
+    # Group exchanges by geographic question; candidate locations keep their
+    # order, as ``geomatcher`` uses it to break ties between equal sizes
+    groups = {}
+    for i, ds in enumerate(datasets):
+        for j, exc in enumerate(ds["exchanges"]):
+            if exc["type"] != "technosphere":
+                continue
+            possible_datasets = providers.providers(exc)
+            key = (
+                ds["location"],
+                tuple(dict.fromkeys(obj["location"] for obj in possible_datasets)),
+            )
+            groups.setdefault(key, []).append((i, j, exc, possible_datasets))
+
+    new_exchanges = {}
+    for (location, possible_locations), members in groups.items():
+        locations = provider_locations(
+            location, list(possible_locations), exclusive, biggest_first, contained
+        )
+        for i, j, exc, possible_datasets in members:
+            kept = [
+                obj
+                for loc in locations
+                for obj in possible_datasets
+                if obj["location"] == loc
+            ]
+            if not kept:
+                if not drop_invalid:
+                    raise InvalidLink
                 log(
                     {
                         "function": "relink_technosphere_exchanges",
@@ -106,68 +149,134 @@ def relink_technosphere_exchanges(
                             exc["name"], exc["product"], exc["unit"]
                         ),
                     },
-                    ds,
+                    datasets[i],
                 )
+            new_exchanges[(i, j)] = allocate_inputs(exc, kept) if kept else []
+
+    for i, ds in enumerate(datasets):
+        exchanges = [exc for exc in ds["exchanges"] if exc["type"] != "technosphere"]
+        for j, exc in enumerate(ds["exchanges"]):
+            if exc["type"] != "technosphere":
                 continue
-            else:
-                raise InvalidLink
-
-        allocated = allocate_inputs(exc, kept)
-
-        for obj in allocated:
-            log(
-                {
-                    "function": "relink_technosphere_exchanges",
-                    "message": MESSAGE.format(
-                        exc["name"],
-                        exc["product"],
-                        exc["unit"],
-                        exc["amount"],
-                        ds["location"],
-                        obj["amount"],
-                        obj["location"],
-                    ),
-                },
-                ds,
-            )
+            for obj in new_exchanges[(i, j)]:
+                log(
+                    {
+                        "function": "relink_technosphere_exchanges",
+                        "message": MESSAGE.format(
+                            exc["name"],
+                            exc["product"],
+                            exc["unit"],
+                            exc["amount"],
+                            ds["location"],
+                            obj["amount"],
+                            obj["location"],
+                        ),
+                    },
+                    ds,
+                )
+                exchanges.append(obj)
+        ds["exchanges"] = exchanges
+        if consumers is not None:
+            consumers.update(ds)
+    mark_modified(data)
+    return datasets
 
-        new_exchanges.extend(allocated)
 
-    ds["exchanges"] = [
-        exc for exc in ds["exchanges"] if exc["type"] != "technosphere"
-    ] + new_exchanges
-    return ds
+def provider_locations(
+    location, possible_locations, exclusive=True, biggest_first=False, contained=True
+):
+    """Select provider locations from ``possible_locations`` for a dataset in ``location``, following the rules of ``relink_technosphere_exchanges``.
+
+    Returns a list of locations, which is empty if there are no valid providers.
+
+    Answers are cached in a bounded LRU cache, keyed by all arguments, with ``possible_locations`` reduced to its unique values. Order is kept, as ``geomatcher`` uses it to break ties between locations of the same size. See ``geo_cache_info`` and ``clear_geo_cache``.
+    """
+    return list(
+        _provider_locations(
+            location,
+            tuple(dict.fromkeys(possible_locations)),
+            exclusive,
+            biggest_first,
+            contained,
+        )
+    )
+
+
+@lru_cache(maxsize=GEO_CACHE_SIZE)
+def _provider_locations(
+    location, possible_locations, exclusive, biggest_first, contained
+):
+    with resolved_row(possible_locations, geomatcher) as g:
+        func = g.contained if contained else g.intersects
+        gis_match = func(
+            location,
+            include_self=True,
+            exclusive=exclusive,
+            biggest_first=biggest_first,
+            only=list(possible_locations),
+        )
+
+    kept = [loc for loc in gis_match if loc in possible_locations]
+
+    if kept:
+        missing_faces = topology.difference(location, kept)
+        if missing_faces and "RoW" in possible_locations:
+            kept.append("RoW")
+    elif "RoW" in possible_locations:
+        kept = ["RoW"]
+
+    if not kept and "GLO" in possible_locations:
+        kept = ["GLO"]
+    return tuple(kept)
+
+
+def geo_cache_info():
+    """Return hits, misses and size of the ``provider_locations`` cache, as a ``functools`` ``CacheInfo`` tuple."""
+    return _provider_locations.cache_info()
+
+
+def clear_geo_cache():
+    """Empty the ``provider_locations`` cache and the cached location masks of ``wurst.geo.topology``. Call this after changing the topology of ``geomatcher``, e.g. with ``add_definitions``."""
+    _provider_locations.cache_clear()
+    topology.clear()
 
 
 def allocate_inputs(exc, lst):
     """Allocate the input exchanges in ``lst`` to ``exc``, using production volumes where possible, and equal splitting otherwise.
 
-    Always uses equal splitting if ``RoW`` is present."""
+    Always uses equal splitting if ``RoW`` is present. New exchanges are made with ``clone_exchange``, so nested values like ``properties`` are shared with ``exc``.
+    """
     has_row = any((x["location"] in ("RoW", "GLO") for x in lst))
-    pvs = [reference_product(o).get("production volume") or 0 for o in lst]
-    if all((x > 0 for x in pvs)) and not has_row:
+    pvs = np.array(
+        [reference_product(o).get("production volume") or 0 for o in lst],
+        dtype=float,
+    )
+    if (pvs > 0).all() and not has_row:
         # Allocate using production volume
-        total = sum(pvs)
+        shares = (pvs / pvs.sum()).tolist()
     else:
         # Allocate evenly
-        total = len(lst)
-        pvs = [1 for _ in range(total)]
+        shares = [1 / len(lst)] * len(lst)
 
     def new_exchange(exc, location, factor):
-        cp = deepcopy(exc)
+        cp = clone_exchange(exc)
         cp["location"] = location
         return rescale_exchange(cp, factor)
 
     return [
-        new_exchange(exc, obj["location"], factor / total)
-        for obj, factor in zip(lst, pvs)
+        new_exchange(exc, obj["location"], share) for obj, share in zip(lst, shares)
     ]
 
 
-def get_possibles(exchange, data):
+def get_possibles(exchange, data, providers=None):
     """FIlter a list of datasets ``data``, returning those with the save name, reference product, and unit as in ``exchange``.
 
+    If a ``ProviderIndex`` of ``data`` is given as ``providers``, it is used instead of scanning ``data``.
+
     Returns a generator."""
+    if providers is not None:
+        yield from providers.providers(exchange)
+        return
     key = (exchange["name"], exchange["product"], exchange["unit"])
     for ds in data:
         if (ds["name"], ds["reference product"], ds["unit"]) == key:
@@ -181,4 +290,5 @@ def default_global_location(database):
     """
     for ds in get_many(database, *[equals("location", None)]):
         ds["location"] = "GLO"
+    mark_modified(database, ["location"])
     return database
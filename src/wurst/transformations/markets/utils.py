@@ -1,3 +1,6 @@
+from wurst.searching import either, startswith
+
+
 def market_like(ds):
     """Find market activities which aren't called markets.
 
@@ -15,9 +18,9 @@ def market_like(ds):
     return amount <= sum(exc["amount"] for exc in similar_inputs) <= amount * 1.5
 
 
-def ecoinvent_market(ds):
-    return (
-        ds["name"].startswith("market for")
-        or ds["name"].startswith("market group")
-        # or market_like(ds)
-    )
+# Filter for ecoinvent markets; can be answered by the prefix index of a ``DatasetIndex``
+ecoinvent_market = either(
+    startswith("name", "market for"),
+    startswith("name", "market group"),
+    # market_like,
+)
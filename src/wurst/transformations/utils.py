@@ -1,8 +1,23 @@
-from copy import deepcopy
+from copy import copy, deepcopy
 
 from wurst.filesystem import get_uuid
 
 
+UNCERTAINTY_FIELDS = ("pedigree",)
+
+
+def clone_exchange(exc):
+    """Copy exchange ``exc`` without a deep copy.
+
+    Numeric and uncertainty values (``amount``, ``loc``, ``scale``, etc.) are immutable, so a shallow copy can be rescaled independently of the original. Mutable uncertainty fields (``pedigree``) are copied as well; other nested values, like ``properties``, are shared with ``exc``.
+    """
+    cp = dict(exc)
+    for field in UNCERTAINTY_FIELDS:
+        if field in cp:
+            cp[field] = copy(cp[field])
+    return cp
+
+
 def copy_dataset(ds):
     """Copy dataset and generate new codes."""
     cp = deepcopy(ds)
@@ -451,6 +451,46 @@ def test_brightway25_with_metadata(bw25_setup):
     assert db.metadata["author"] == "test_user_25"
 
 
+def test_brightway25_with_registry_resolves_links(bw25_setup):
+    """Test that links interned by a ``KeyRegistry`` are tuples again after writing."""
+    from wurst.linking import KeyRegistry
+
+    modified = [
+        {
+            "location": "GLO",
+            "database": "c",
+            "code": "3",
+            "name": "test_activity",
+            "reference product": "test_product",
+            "unit": "kg",
+            "modified": True,
+            "exchanges": [
+                {
+                    "amount": 1,
+                    "type": "production",
+                    "name": "test_activity",
+                    "product": "test_product",
+                    "location": "GLO",
+                    "unit": "kg",
+                    "database": "c",
+                },
+                {
+                    "amount": 2,
+                    "type": "technosphere",
+                    "input": ("a", "1"),
+                    "database": "a",
+                    "modified": True,
+                },
+            ],
+        }
+    ]
+
+    write_brightway25_database(modified, "test_registry_25", registry=KeyRegistry())
+
+    inputs = [exc["input"] for exc in modified[0]["exchanges"]]
+    assert inputs == [("test_registry_25", "3"), ("a", "1")]
+
+
 # ============================================================================
 # MISSING TEST COVERAGE
 # ============================================================================
@@ -0,0 +1,85 @@
+import numpy as np
+import pytest
+
+from wurst.columnar import ColumnarDatabase
+from wurst.errors import NoResults
+from wurst.searching import *
+
+
+@pytest.fixture
+def data():
+    return [
+        {"name": "electricity, hard coal", "unit": "kilowatt hour", "location": "CH"},
+        {"name": "electricity, lignite", "unit": "kilowatt hour", "location": "DE"},
+        {"name": "heat, hard coal", "unit": "megajoule", "location": "CH"},
+        {"name": "market for electricity", "unit": "kilowatt hour", "location": "CH"},
+        {"unit": "kilowatt hour"},
+    ]
+
+
+def test_columnar_equals(data):
+    table = ColumnarDatabase(data)
+    assert list(get_many(table, equals("location", "CH"))) == [
+        data[0],
+        data[2],
+        data[3],
+    ]
+    assert list(get_many(table, equals("location", None))) == [data[4]]
+    assert (
+        get_one(table, equals("unit", "megajoule"), equals("location", "CH")) == data[2]
+    )
+    with pytest.raises(NoResults):
+        get_one(table, equals("location", "FR"))
+
+
+def test_columnar_string_filters(data):
+    table = ColumnarDatabase(data)
+    coal = either(contains("name", "hard coal"), contains("name", "lignite"))
+    assert list(get_many(table, coal, equals("unit", "kilowatt hour"))) == data[:2]
+    assert list(get_many(table, startswith("name", "market"))) == [data[3]]
+    assert list(get_many(table, exclude(coal))) == data[3:]
+    assert list(get_many(table, doesnt_contain_any("name", ["coal", "market"]))) == [
+        data[1],
+        data[4],
+    ]
+
+
+def test_columnar_mask(data):
+    table = ColumnarDatabase(data)
+    assert table.mask(equals("location", "CH")).tolist() == [
+        True,
+        False,
+        True,
+        True,
+        False,
+    ]
+    assert table.mask(lambda x: True) is None
+    assert table.mask(equals("foo", "bar")) is None
+    assert isinstance(table.columns["name"].codes, np.ndarray)
+
+
+def test_columnar_opaque_filters(data):
+    table = ColumnarDatabase(data)
+    assert list(
+        get_many(table, equals("location", "CH"), lambda x: x["unit"] == "megajoule")
+    ) == [data[2]]
+
+
+def test_columnar_appended(data):
+    table = ColumnarDatabase(data)
+    assert len(list(get_many(table, equals("location", "CH")))) == 3
+    table.append({"name": "foo", "location": "CH"})
+    assert len(list(get_many(table, equals("location", "CH")))) == 4
+    assert table.mask(equals("location", "CH")).sum() == 4
+    table.extend([{"name": "bar", "location": "DE"}])
+    assert len(table.mask(equals("location", "CH"))) == len(data)
+    data[0]["location"] = "FR"
+    table.rebuild()
+    assert len(list(get_many(table, equals("location", "CH")))) == 3
+
+
+def test_columnar_unhashable_column():
+    data = [{"name": ["a"]}, {"name": ["b"]}]
+    table = ColumnarDatabase(data)
+    assert "name" not in table.columns
+    assert list(get_many(table, equals("name", ["b"]))) == [data[1]]
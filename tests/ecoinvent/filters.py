@@ -1,5 +1,5 @@
-from wurst import get_many
-from wurst.ecoinvent.filters import _oil
+from wurst import classify, get_many
+from wurst.ecoinvent.filters import _oil, electricity_technologies
 
 
 def test_oil():
@@ -13,3 +13,18 @@ def test_oil():
         {"name": "electricity production, oil"},
     ]
     assert list(get_many(given, _oil)) == expected
+
+
+def test_electricity_technologies():
+    given = [
+        {"name": "electricity production, hard coal", "unit": "kilowatt hour"},
+        {"name": "heat and power co-generation, lignite", "unit": "kilowatt hour"},
+        {"name": "electricity production, nuclear", "unit": "kilowatt hour"},
+        {"name": "electricity production, oil", "unit": "kilowatt hour"},
+        {"name": "heat production, hard coal", "unit": "megajoule"},
+    ]
+    result = classify(given, electricity_technologies)
+    for label, filters in electricity_technologies.items():
+        assert result[label] == list(get_many(given, *filters))
+    assert result["coal"] == given[:1]
+    assert result["coal CHP"] == given[1:2]
@@ -1,8 +1,8 @@
 import pytest
-from constructive_geometries import ConstructiveGeometries, Geomatcher
+from constructive_geometries import ConstructiveGeometries, Geomatcher, resolved_row
 
 from wurst import geomatcher
-from wurst.geo import IMAGE_TOPOLOGY, REMIND_TOPOLOGY
+from wurst.geo import IMAGE_TOPOLOGY, REMIND_TOPOLOGY, BitsetTopology, topology
 
 
 def test_default_setup():
@@ -34,3 +34,30 @@ def test_remind_added():
     assert ("REMIND", "EUR") in geomatcher
     g = Geomatcher()
     assert ("REMIND", "EUR") not in g
+
+
+def test_bitset_topology():
+    assert topology.faces(topology.mask("CH")) == geomatcher["CH"]
+    assert topology.size(topology.mask("CH")) == len(geomatcher["CH"])
+    assert topology.contains("RER", "CH")
+    assert not topology.contains("CH", "RER")
+    assert topology.intersects("RER", "CH")
+    assert not topology.intersects("FR", "CH")
+    assert topology.faces(topology.union(["CH", "FR"])) == geomatcher["CH"].union(
+        geomatcher["FR"]
+    )
+    assert topology.faces(topology.difference("RER", ["CH", "FR"])) == geomatcher[
+        "RER"
+    ].difference(geomatcher["CH"], geomatcher["FR"])
+    assert topology.contained("RER", ["CH", "US", "RoW", "FR"]) == ["CH", "FR"]
+    assert topology.within("CH", ["CH", "US", "RER", "GLO"]) == ["CH", "RER", "GLO"]
+
+
+def test_bitset_topology_row_not_cached():
+    g = Geomatcher()
+    bits = BitsetTopology(g)
+    assert bits.mask("RoW") == 0
+    with resolved_row(["CH", "RoW"], g):
+        assert bits.mask("RoW") == bits.difference("GLO", ["CH"])
+    assert bits.mask("RoW") == 0
+    assert "RoW" not in bits.masks
@@ -0,0 +1,87 @@
+import numpy as np
+import pytest
+
+from wurst.graph import TechnosphereGraph
+from wurst.linking import KeyRegistry
+
+
+def dataset(name, inputs=()):
+    return {
+        "name": name,
+        "database": "db",
+        "code": name,
+        "exchanges": [
+            {"type": "production", "input": ("db", name), "amount": 1},
+        ]
+        + [
+            {"type": "technosphere", "input": ("db", other), "amount": 1}
+            for other in inputs
+        ]
+        + [{"type": "biosphere", "input": ("bio", "co2"), "amount": 1}],
+    }
+
+
+@pytest.fixture
+def data():
+    # a -> b -> c -> d, with c <-> e forming a cycle; f is unrelated
+    return [
+        dataset("a", ["b"]),
+        dataset("b", ["c", "missing"]),
+        dataset("c", ["d", "e"]),
+        dataset("d"),
+        dataset("e", ["c"]),
+        dataset("f"),
+    ]
+
+
+def test_graph_structure(data):
+    graph = TechnosphereGraph(data)
+    assert len(graph) == 6
+    assert graph.edges == 5
+    assert graph.index(("db", "c")) == graph.index(data[2]) == 2
+    assert list(graph.neighbours(data[2])) == [3, 4]
+    assert [ds["name"] for ds in graph.consumers(data[2])] == ["b", "e"]
+    assert [ds["name"] for ds in graph.providers(data[0])] == ["b"]
+
+
+def test_graph_traversal(data):
+    graph = TechnosphereGraph(data)
+    assert [ds["name"] for ds in graph.upstream(data[0])] == ["b", "c", "d", "e"]
+    assert [ds["name"] for ds in graph.upstream(data[0], max_depth=2)] == ["b", "c"]
+    assert [ds["name"] for ds in graph.downstream(data[3])] == ["c", "b", "e", "a"]
+    assert list(graph.bfs([0, 4], max_depth=1)) == [1, 2]
+    assert list(graph.bfs(5)) == []
+    assert graph.dfs(0) == [1, 2, 3, 4]
+    assert graph.dfs(0, max_depth=1) == [1]
+    with pytest.raises(ValueError):
+        graph.bfs(0, direction="sideways")
+
+
+def test_graph_components(data):
+    graph = TechnosphereGraph(data)
+    components = graph.strongly_connected_components()
+    assert sorted(len(c) for c in components) == [1, 1, 1, 1, 2]
+    assert [list(c) for c in graph.cycles()] == [[2, 4]]
+    assert graph.has_cycles()
+    # Providers come before consumers
+    order = {int(c[0]): n for n, c in enumerate(components)}
+    assert order[3] < order[2] < order[1] < order[0]
+
+    del data[4]["exchanges"][1]
+    assert not TechnosphereGraph(data).has_cycles()
+
+
+def test_graph_long_chain():
+    data = [dataset(str(i), [str(i + 1)]) for i in range(5000)] + [dataset("5000")]
+    graph = TechnosphereGraph(data)
+    assert len(graph.upstream(data[0])) == 5000
+    assert len(graph.dfs(0)) == 5000
+    assert len(graph.strongly_connected_components()) == 5001
+
+
+def test_graph_with_registry(data):
+    registry = KeyRegistry()
+    registry.intern_links(data)
+    graph = TechnosphereGraph(data, registry=registry)
+    assert graph.edges == 5
+    assert isinstance(graph.bfs(data[0]), np.ndarray)
@@ -0,0 +1,383 @@
+import pytest
+
+from wurst.errors import InvalidLink, NonuniqueCode
+from wurst.indexing import ConsumerIndex
+from wurst.linking import (
+    InternalLinker,
+    KeyRegistry,
+    LinkingMetrics,
+    LinkingReport,
+    change_db_name,
+    check_duplicate_codes,
+    check_internal_linking,
+    link_internal,
+    normalize_key,
+    validate_links,
+)
+
+
+def dataset(name, location="CH", database="db", code=None, exchanges=()):
+    return {
+        "name": name,
+        "reference product": name,
+        "unit": "kg",
+        "location": location,
+        "database": database,
+        "code": code or name + location,
+        "exchanges": [
+            {
+                "name": name,
+                "product": name,
+                "unit": "kg",
+                "location": location,
+                "amount": 1,
+                "type": "production",
+            }
+        ]
+        + list(exchanges),
+    }
+
+
+def technosphere(name, location="CH"):
+    return {
+        "name": name,
+        "product": name,
+        "unit": "kg",
+        "location": location,
+        "amount": 1,
+        "type": "technosphere",
+    }
+
+
+def test_link_internal():
+    data = [dataset("a"), dataset("b", exchanges=[technosphere("a")])]
+    link_internal(data)
+    assert data[1]["exchanges"][1]["input"] == ("db", "aCH")
+    with pytest.raises(KeyError):
+        link_internal([dataset("b", exchanges=[technosphere("c")])])
+
+
+def test_link_internal_parallel():
+    data = [dataset(str(i), exchanges=[technosphere(str(i - 1))]) for i in range(1, 20)]
+    data.append(dataset("0"))
+    link_internal(data, processes=2)
+    assert data[3]["exchanges"][1]["input"] == ("db", "3CH")
+    assert all(exc.get("input") for ds in data for exc in ds["exchanges"])
+
+    data = [
+        dataset("a"),
+        dataset("b", exchanges=[technosphere("a"), technosphere("c")]),
+    ]
+    with pytest.raises(KeyError):
+        link_internal(data, processes=2)
+    assert "input" not in data[1]["exchanges"][1]
+    report = LinkingReport()
+    link_internal(data, report=report, processes=2)
+    assert data[1]["exchanges"][1]["input"] == ("db", "aCH")
+    assert report.counts["unlinked"] == {("c", "c", "CH", "kg"): 1}
+
+
+def test_normalize_key():
+    fields = ("name", "unit")
+    assert normalize_key(("Steel,  Low-alloyed ", "KG"), fields) == (
+        "steel, low-alloyed",
+        "kilogram",
+    )
+    assert normalize_key(("kg", "m3"), fields) == ("kg", "cubic meter")
+
+
+def test_link_internal_normalized():
+    exc = technosphere("a")
+    exc.update(name=" A", unit="kilogram")
+    data = [dataset("a"), dataset("b", exchanges=[exc])]
+    with pytest.raises(KeyError):
+        link_internal(data)
+
+    report = LinkingReport()
+    link_internal(data, normalize=True, report=report)
+    assert exc["input"] == ("db", "aCH")
+    assert report.counts["normalized"] == {(" A", "a", "CH", "kilogram"): 1}
+    assert not report
+    assert report.total() == 0
+    assert report.total("normalized") == 1
+
+    # Ambiguous normalized keys aren't linked
+    del exc["input"]
+    data.append(dataset("A"))
+    with pytest.raises(KeyError):
+        link_internal(data, normalize=True)
+
+    del data[-1]
+    link_internal(data, normalize=True, processes=2)
+    assert exc["input"] == ("db", "aCH")
+
+
+def test_link_internal_syncs_consumers():
+    data = [dataset("a")]
+    consumers = ConsumerIndex(data)
+    data.append(dataset("b", exchanges=[technosphere("a")]))
+    link_internal(data, consumers=consumers)
+    assert consumers.consumers(data[0]) == [(data[1], data[1]["exchanges"][1])]
+
+
+def test_internal_linker():
+    data = [dataset("a"), dataset("b", exchanges=[technosphere("a")])]
+    linker = InternalLinker()
+    linker.link(data)
+    assert data[1]["exchanges"][1]["input"] == ("db", "aCH")
+
+    # New datasets are indexed and linked
+    data.append(dataset("c", exchanges=[technosphere("a"), technosphere("d")]))
+    data.append(dataset("d"))
+    linker.link(data)
+    assert data[2]["exchanges"][2]["input"] == ("db", "dCH")
+
+    # Changed exchange lists are relinked
+    data[1]["exchanges"] = data[1]["exchanges"][:1] + [technosphere("d")]
+    linker.link(data)
+    assert data[1]["exchanges"][1]["input"] == ("db", "dCH")
+
+    # Renamed datasets need ``update``
+    data[3]["exchanges"][0]["name"] = data[3]["exchanges"][0]["product"] = "e"
+    linker.update(data[3])
+    data[0]["exchanges"].append(technosphere("e"))
+    linker.link(data)
+    assert data[0]["exchanges"][1]["input"] == ("db", "dCH")
+
+    # Flagged exchanges are relinked
+    linker.update(data[1], exchanges=data[1]["exchanges"][1:])
+    with pytest.raises(KeyError):
+        linker.link(data)
+
+
+def test_internal_linker_database_name_and_removal():
+    data = [dataset("a"), dataset("b", exchanges=[technosphere("a")])]
+    linker = InternalLinker()
+    linker.link(data)
+    change_db_name(data, "new")
+    data.append(dataset("c", exchanges=[technosphere("a")]))
+    linker.link(data)
+    assert data[2]["exchanges"][1]["input"] == ("new", "aCH")
+
+    del data[0]
+    data.append(dataset("d", exchanges=[technosphere("a")]))
+    with pytest.raises(KeyError):
+        linker.link(data)
+
+
+def test_linking_report():
+    biosphere = {"name": "CO2", "unit": "kg", "amount": 1, "type": "biosphere"}
+    data = [
+        dataset("a"),
+        dataset("b", exchanges=[technosphere("c"), technosphere("c"), biosphere]),
+        dataset("d", exchanges=[technosphere("e"), technosphere("a")]),
+    ]
+    report = LinkingReport()
+    link_internal(data, report=report)
+    assert data[2]["exchanges"][2]["input"] == ("db", "aCH")
+    assert report.counts["unlinked"] == {
+        ("c", "c", "CH", "kg"): 2,
+        ("e", "e", "CH", "kg"): 1,
+    }
+    assert report.counts["biosphere"] == {("CO2", None, None, "kg"): 1}
+    assert report.examples["unlinked"][("e", "e", "CH", "kg")] == (
+        ("db", "dCH"),
+        technosphere("e"),
+    )
+    assert report.total() == 4
+    assert "unlinked: 3 exchanges with 2 unique keys" in report.summary()
+    with pytest.raises(ValueError):
+        report.raise_for_problems()
+
+    report = LinkingReport()
+    InternalLinker().link(data, report=report)
+    assert report.total("unlinked") == 3
+
+
+def test_internal_linker_duplicate_providers():
+    data = [dataset("a"), dataset("a")]
+    data[1]["code"] = "other"
+    linker = InternalLinker()
+    linker.link(data)
+
+    # The remaining provider of the same key is still indexed
+    del data[1]
+    data.append(dataset("b", exchanges=[technosphere("a")]))
+    linker.link(data)
+    assert data[1]["exchanges"][1]["input"] == ("db", "aCH")
+
+
+def test_internal_linker_report_retries_unlinked():
+    data = [dataset("a", exchanges=[technosphere("b")])]
+    linker = InternalLinker()
+    report = LinkingReport()
+    linker.link(data, report=report)
+    assert report.total("unlinked") == 1
+
+    # The provider is added later; the unchanged consumer is retried
+    data.append(dataset("b"))
+    report = LinkingReport()
+    linker.link(data, report=report)
+    assert report.total() == 0
+    assert data[0]["exchanges"][1]["input"] == ("db", "bCH")
+
+
+def test_check_internal_linking_report():
+    data = [dataset("a"), dataset("b", exchanges=[technosphere("a")])]
+    data[1]["exchanges"][1]["input"] = ("db", "missing")
+    data[1]["exchanges"].append(dict(data[1]["exchanges"][1]))
+    with pytest.raises(InvalidLink):
+        check_internal_linking(data)
+
+    report = LinkingReport()
+    check_internal_linking(data, report=report)
+    assert report.counts["dangling"] == {("db", "missing"): 2}
+    assert report
+    assert not LinkingReport()
+    with pytest.raises(InvalidLink):
+        report.raise_for_problems()
+
+
+def test_key_registry():
+    registry = KeyRegistry()
+    assert registry.id(("db", "a")) == 1
+    assert registry.id(["db", "a"]) == 1
+    assert registry.id(("db", "b")) == 2
+    assert registry.key(2) == ("db", "b")
+    assert registry.resolve(("x", "y")) == ("x", "y")
+    assert len(registry) == 2
+
+
+def test_key_registry_rename_databases():
+    registry = KeyRegistry()
+    a, b, c = registry.id(("x", "a")), registry.id(("y", "b")), registry.id(("z", "c"))
+    registry.rename_databases(["x", "y"], "new")
+    assert registry.databases == ["new", "new", "z"]
+    assert registry.key(a) == ("new", "a")
+    assert registry.get(("new", "b")) == b
+    assert registry.get(("x", "a")) is None
+    assert registry.id(("new", "d")) == 4
+    assert registry.keys == [None, ("new", "a"), ("new", "b"), ("z", "c"), ("new", "d")]
+    assert registry.database_mask(["new"]).tolist() == [False, True, True, False, True]
+
+
+def test_link_internal_with_registry():
+    data = [
+        dataset("a"),
+        dataset("b", exchanges=[technosphere("a")]),
+        dataset("c", exchanges=[technosphere("a")]),
+    ]
+    registry = KeyRegistry()
+    link_internal(data, registry=registry)
+    assert isinstance(data[1]["exchanges"][1]["input"], int)
+    check_internal_linking(data, registry=registry)
+
+    change_db_name(data, "new", registry=registry)
+    check_internal_linking(data, registry=registry)
+    registry.resolve_links(data)
+    assert data[1]["exchanges"][1]["input"] == ("new", "aCH")
+    # Resolved links share the same interned tuple
+    assert data[1]["exchanges"][1]["input"] is data[2]["exchanges"][1]["input"]
+
+    registry.intern_links(data)
+    data[1]["exchanges"][1]["input"] = registry.id(("new", "missing"))
+    report = LinkingReport()
+    check_internal_linking(data, report=report, registry=registry)
+    assert report.counts["dangling"] == {("new", "missing"): 1}
+
+
+def test_change_db_name_with_registry_converts_tuple_links():
+    data = [
+        dataset("a"),
+        dataset("b", exchanges=[technosphere("a"), technosphere("x")]),
+    ]
+    data[1]["exchanges"][1]["input"] = ("db", "aCH")
+    data[1]["exchanges"][2]["input"] = ("external", "x")
+    registry = KeyRegistry()
+    change_db_name(data, "new", registry=registry)
+    assert data[1]["database"] == "new"
+    assert registry.key(data[1]["exchanges"][1]["input"]) == ("new", "aCH")
+    assert data[1]["exchanges"][2]["input"] == ("external", "x")
+    check_internal_linking(data, registry=registry)
+    assert not validate_links(data, registry=registry)
+
+
+def test_check_duplicate_codes():
+    check_duplicate_codes([dataset("a"), dataset("b")])
+    with pytest.raises(NonuniqueCode):
+        check_duplicate_codes([dataset("a"), dataset("a"), dataset("b")])
+
+
+def test_check_duplicate_codes_mixed_types():
+    data = [dataset("a"), dataset("b"), dataset("c")]
+    data[0]["code"], data[1]["code"], data[2]["code"] = 1, "1", None
+    check_duplicate_codes(data)
+    data.append(dataset("d"))
+    data[3]["code"] = None
+    with pytest.raises(NonuniqueCode):
+        check_duplicate_codes(data)
+
+
+def test_validate_links():
+    data = [
+        dataset("a"),
+        dataset("a"),
+        dataset("b", exchanges=[technosphere("a"), technosphere("c")]),
+        dataset("d", database="other", exchanges=[technosphere("a")]),
+    ]
+    data[2]["exchanges"][1]["input"] = ("db", "aCH")
+    data[2]["exchanges"][2]["input"] = ("db", "missing")
+    data[3]["exchanges"][1]["input"] = ("other", "missing")
+    data[3]["exchanges"].append(technosphere("x"))
+    data[3]["exchanges"][2]["input"] = ("external", "anything")
+
+    report = validate_links(data)
+    assert report.counts["dangling"] == {("db", "missing"): 1, ("other", "missing"): 1}
+    assert report.examples["dangling"][("db", "missing")][1] is data[2]["exchanges"][2]
+    assert report.counts["duplicate_code"] == {"aCH": 2}
+    with pytest.raises(InvalidLink):
+        report.raise_for_problems()
+
+    data[2]["exchanges"].pop()
+    data[3]["exchanges"].pop(1)
+    with pytest.raises(NonuniqueCode):
+        validate_links(data).raise_for_problems()
+    data[1]["code"] = "other"
+    assert not validate_links(data)
+    data[1]["code"] = "aCH"
+    assert not validate_links(data, unique=data[1:])
+
+
+def test_validate_links_with_registry():
+    data = [dataset("a"), dataset("b", exchanges=[technosphere("a")])]
+    registry = KeyRegistry()
+    link_internal(data, registry=registry)
+    assert not validate_links(data, registry=registry)
+    data[1]["exchanges"][1]["input"] = registry.id(("db", "missing"))
+    assert validate_links(data, registry=registry).counts["dangling"] == {
+        ("db", "missing"): 1
+    }
+
+
+def test_linking_metrics():
+    data = [
+        dataset("a"),
+        dataset("b", exchanges=[technosphere("a"), technosphere("c")]),
+    ]
+    data[0]["exchanges"][0]["input"] = ("db", "aCH")
+    metrics = LinkingMetrics()
+    link_internal(data, report=LinkingReport(), metrics=metrics)
+    stats = metrics.passes[0]
+    assert stats["function"] == "link_internal"
+    assert (stats["datasets"], stats["exchanges"]) == (2, 4)
+    assert (stats["hits"], stats["misses"], stats["skipped"]) == (2, 1, 1)
+    assert stats["wall_time"] >= stats["index_time"] >= 0
+
+    data[1]["exchanges"][2]["input"] = ("db", "missing")
+    data[1]["exchanges"].append(dict(technosphere("x"), input=("other", "x")))
+    check_internal_linking(data, report=LinkingReport(), metrics=metrics)
+    stats = metrics.passes[1]
+    assert (stats["hits"], stats["misses"], stats["skipped"]) == (3, 1, 1)
+    assert metrics.totals()["exchanges"] == 9
+    assert metrics.totals("link_internal")["exchanges"] == 4
+    assert "check_internal_linking: 2 datasets" in metrics.summary()
@@ -1,6 +1,8 @@
 import pytest
 
 from wurst.errors import MultipleResults, NoResults
+from wurst.indexing import ConsumerIndex, DatasetIndex, ProviderIndex, mark_modified
+from wurst.transformations import default_global_location
 from wurst.searching import *
 
 
@@ -257,3 +259,394 @@ def test_best_geo_match():
 
     order = ["foo", "bar", "july"]
     assert best_geo_match(given, order) is None
+
+
+def test_dataset_index_equals():
+    data = [
+        {"name": "foo", "location": "CH"},
+        {"name": "foo", "location": "DE"},
+        {"name": "bar", "location": "CH"},
+    ]
+    index = DatasetIndex(data)
+    assert list(get_many(index, equals("name", "foo"))) == data[:2]
+    assert get_one(index, equals("name", "foo"), equals("location", "DE")) == {
+        "name": "foo",
+        "location": "DE",
+    }
+    assert list(get_many(index, equals("name", "foo"), contains("location", "C"))) == [
+        {"name": "foo", "location": "CH"}
+    ]
+    with pytest.raises(NoResults):
+        get_one(index, equals("name", "baz"))
+    assert index.lookup("name", "foo") == [0, 1]
+
+
+def test_dataset_index_missing_field():
+    index = DatasetIndex([{"name": "foo"}, {"name": "bar", "location": "CH"}])
+    assert list(get_many(index, equals("location", None))) == [{"name": "foo"}]
+
+
+def test_dataset_index_unhashable_values():
+    data = [{"categories": ["air"]}, {"categories": ["water"]}]
+    index = DatasetIndex(data)
+    assert index.lookup("categories", ["air"]) is None
+    assert get_one(index, equals("categories", ["air"])) == data[0]
+
+
+def test_dataset_index_picks_up_appended_datasets():
+    data = [{"name": "foo"}]
+    index = DatasetIndex(data)
+    assert len(list(get_many(index, equals("name", "foo")))) == 1
+    data.append({"name": "foo"})
+    index.append({"name": "foo"})
+    assert len(list(get_many(index, equals("name", "foo")))) == 3
+    index.data[0]["name"] = "bar"
+    index.rebuild()
+    assert len(list(get_many(index, equals("name", "foo")))) == 2
+
+
+def test_filters_are_introspectable():
+    func = equals("n", "foo")
+    assert (func.field, func.value) == ("n", "foo")
+    assert func.key == ("equals", "n", "foo")
+    assert repr(either(func, exclude(contains("n", "b")))) == (
+        "either(equals('n', 'foo'), exclude(contains('n', 'b')))"
+    )
+    assert contains("n", "x").key == contains("n", "x").key
+    assert repr(equals("x", [1, 2])) == "equals('x', [1, 2])"
+    assert repr(doesnt_contain_any("x", ["a"])) == "doesnt_contain_any('x', ('a',))"
+
+
+def test_contains_missing_field():
+    assert not contains("n", "foo")({})
+    assert doesnt_contain_any("n", ["foo"])({})
+
+
+def test_plan_orders_by_cost():
+    opaque = lambda x: True
+    funcs = [opaque, contains("n", "a"), startswith("n", "b"), equals("n", "c")]
+    assert plan(funcs) == [funcs[3], funcs[2], funcs[1], opaque]
+
+
+def test_plan_merges_either_equals():
+    (func,) = plan([either(equals("n", "foo"), equals("n", "bar"))])
+    assert isinstance(func, In)
+    assert func({"n": "bar"})
+    assert not func({"n": "baz"})
+
+    (func,) = plan([either(equals("n", "foo"), equals("m", "bar"))])
+    assert isinstance(func, Either)
+
+
+def test_dataset_index_either_equals():
+    data = [{"n": "foo"}, {"n": "bar"}, {"n": "baz"}]
+    index = DatasetIndex(data)
+    assert list(get_many(index, either(equals("n", "baz"), equals("n", "foo")))) == [
+        {"n": "foo"},
+        {"n": "baz"},
+    ]
+
+
+def test_dataset_index_substring():
+    data = [
+        {"name": "electricity production, hard coal", "unit": "kilowatt hour"},
+        {"name": "electricity production, lignite", "unit": "kilowatt hour"},
+        {"name": "heat production, hard coal", "unit": "megajoule"},
+        {"name": "electricity production, nuclear", "unit": "kilowatt hour"},
+        {"unit": "kilowatt hour"},
+    ]
+    index = DatasetIndex(data, substring_fields=["name"])
+    coal = either(contains("name", "hard coal"), contains("name", "lignite"))
+    assert list(get_many(index, coal, contains("name", "electricity"))) == data[:2]
+    assert list(get_many(index, doesnt_contain_any("name", ["coal", "nuclear"]))) == [
+        data[1],
+        data[4],
+    ]
+    assert (
+        list(get_many(index, equals("unit", "kilowatt hour"), exclude(coal)))
+        == data[3:]
+    )
+    # Too short for trigrams; falls back to scanning
+    assert list(get_many(index, contains("name", "al"))) == [data[0], data[2]]
+    assert index.lookup_substring("name", "production") == {0, 1, 2, 3}
+    assert index.lookup_substring("unit", "hour") is None
+
+
+def test_dataset_index_substring_appended():
+    data = [{"name": "foo bar"}]
+    index = DatasetIndex(data, substring_fields=["name"])
+    assert index.lookup_substring("name", "bar") == {0}
+    index.append({"name": "bar baz"})
+    assert index.lookup_substring("name", "bar") == {0, 1}
+
+
+def test_dataset_index_prefix():
+    data = [
+        {"name": "market group for electricity"},
+        {"name": "electricity production"},
+        {"name": "market for electricity"},
+        {"name": "market"},
+        {},
+    ]
+    index = DatasetIndex(data)
+    assert list(get_many(index, startswith("name", "market for"))) == [data[2]]
+    assert list(
+        get_many(
+            index,
+            either(
+                startswith("name", "market for"), startswith("name", "market group")
+            ),
+        )
+    ) == [data[0], data[2]]
+    assert index.lookup_prefix("name", "market") == {0, 2, 3}
+    assert index.lookup_prefix("name", ("elec", "market g")) == {0, 1}
+    assert index.lookup_prefix("name", "zzz") == set()
+    index.append({"name": "market for heat"})
+    assert index.lookup_prefix("name", "market for") == {2, 5}
+
+
+def test_ecoinvent_market_uses_prefix_index():
+    from wurst.transformations.markets.utils import ecoinvent_market
+
+    data = [
+        {"name": "market for heat"},
+        {"name": "heat production"},
+        {"name": "market group for electricity"},
+        {},
+    ]
+    index = DatasetIndex(data)
+    assert list(get_many(data, ecoinvent_market)) == [data[0], data[2]]
+    assert list(get_many(index, ecoinvent_market)) == [data[0], data[2]]
+    assert index._positions(ecoinvent_market) == {0, 2}
+
+
+def test_startswith_empty_prefix_matches_missing_values():
+    data = [{"name": "foo"}, {"name": None}, {}]
+    assert list(get_many(data, startswith("name", ""))) == data
+    assert list(get_many(DatasetIndex(data), startswith("name", ""))) == data
+    assert DatasetIndex(data).lookup_prefix("name", "f") == {0}
+
+
+def test_exchange_cache():
+    ds = {
+        "exchanges": [
+            {"type": "production", "n": "foo", "amount": 1},
+            {"type": "technosphere", "n": "bar", "amount": 1},
+        ]
+    }
+    with exchange_cache():
+        assert list(technosphere(ds)) == [ds["exchanges"][1]]
+        assert reference_product(ds) is ds["exchanges"][0]
+        assert list(technosphere(ds, equals("n", "baz"))) == []
+
+        # Mutation detected by length
+        ds["exchanges"].append({"type": "technosphere", "n": "baz", "amount": 1})
+        assert len(list(technosphere(ds))) == 2
+
+        # Replacement detected by identity
+        ds["exchanges"] = ds["exchanges"][:1]
+        assert list(technosphere(ds)) == []
+        assert reference_product(ds) is ds["exchanges"][0]
+
+        # In-place changes need explicit invalidation
+        ds["exchanges"][0]["type"] = "technosphere"
+        assert reference_product(ds) is ds["exchanges"][0]
+        invalidate_exchange_cache(ds)
+        with pytest.raises(NoResults):
+            reference_product(ds)
+        assert len(list(technosphere(ds))) == 1
+
+    ds["exchanges"][0]["type"] = "production"
+    assert reference_product(ds) is ds["exchanges"][0]
+
+
+def test_best_geo_match_ties():
+    given = [{"location": "one", "n": 1}, {"location": "one", "n": 2}]
+    assert best_geo_match(given, ["one"]) == {"location": "one", "n": 1}
+
+
+def test_best_geo_matches():
+    groups = [
+        [{"location": "one"}, {"location": "two"}],
+        [{"location": "three"}],
+        [],
+        [{"location": "three"}, {"location": "two"}],
+    ]
+    order = LocationRanking(["two", "one"])
+    assert best_geo_match(groups[0], order) == {"location": "two"}
+    assert best_geo_matches(groups, order) == [
+        {"location": "two"},
+        None,
+        None,
+        {"location": "two"},
+    ]
+    matches, ranks = best_geo_matches(groups, ["one", "two"], return_ranks=True)
+    assert matches[0] == {"location": "one"}
+    assert ranks.tolist() == [0, -1, -1, 1]
+
+
+def test_classify():
+    data = [
+        {"n": "foo", "u": "kg"},
+        {"n": "foobar", "u": "kg"},
+        {"n": "bar", "u": "m"},
+    ]
+    calls = []
+
+    def opaque(x):
+        calls.append(x["n"])
+        return True
+
+    kg = equals("u", "kg")
+    result = classify(
+        data,
+        {
+            "foo": [contains("n", "foo"), kg, opaque],
+            "kg": [equals("u", "kg"), opaque],
+            "none": [equals("n", "nope")],
+        },
+    )
+    assert result == {"foo": data[:2], "kg": data[:2], "none": []}
+    # Opaque function shared between lists is called once per dataset
+    assert calls == ["foo", "foobar"]
+    assert classify(DatasetIndex(data), {"m": [equals("u", "m")]}) == {"m": [data[2]]}
+
+
+def test_dataset_index_cached_results():
+    data = [{"name": "foo", "location": None}, {"name": "bar", "location": "CH"}]
+    index = DatasetIndex(data, cache_results=True)
+    funcs = [equals("name", "foo"), contains("name", "o")]
+    assert list(get_many(index, *funcs)) == data[:1]
+    assert list(get_many(index, *reversed(funcs))) == data[:1]
+    assert len(index._results) == 1
+
+    # Plain functions can't be cached
+    list(get_many(index, lambda x: True))
+    assert len(index._results) == 1
+
+    generation = index.generation
+    index.append({"name": "foo", "location": "DE"})
+    assert len(list(get_many(index, *funcs))) == 2
+    assert index.generation > generation
+
+
+def test_filter_keys_distinguish_container_types():
+    data = [{"n": [1]}, {"n": (1,)}]
+    assert equals("n", [1]).key != equals("n", (1,)).key
+    index = DatasetIndex(data, cache_results=True)
+    assert list(get_many(index, equals("n", [1]))) == data[:1]
+    assert list(get_many(index, equals("n", (1,)))) == data[1:]
+    result = classify(data, {"list": [equals("n", [1])], "tuple": [equals("n", (1,))]})
+    assert result == {"list": data[:1], "tuple": data[1:]}
+
+
+def test_mark_modified():
+    data = [{"name": "foo"}, {"name": "bar", "location": "CH"}]
+    index = DatasetIndex(data, cache_results=True)
+    assert list(get_many(index, equals("location", "GLO"))) == []
+    default_global_location(index)
+    assert list(get_many(index, equals("location", "GLO"))) == data[:1]
+
+    generation = index.generation
+    mark_modified(index)
+    mark_modified(data)
+    assert index.generation == generation + 1
+
+
+def test_get_many_limit():
+    data = [{"n": "foo"}, {"n": "foo"}, {"n": "foo"}]
+    assert len(list(get_many(data, equals("n", "foo"), limit=2))) == 2
+    assert len(list(get_many(DatasetIndex(data), equals("n", "foo"), limit=1))) == 1
+    assert get_first(data, equals("n", "foo")) is data[0]
+    with pytest.raises(NoResults):
+        get_first(data, equals("n", "bar"))
+
+
+def test_get_one_short_circuits():
+    seen = []
+
+    def watch(x):
+        seen.append(x)
+        return True
+
+    data = [{"n": "foo"}] * 10
+    with pytest.raises(MultipleResults) as error:
+        get_one(data, watch)
+    assert len(seen) == 2
+    assert "At least two results" in str(error.value)
+
+
+def test_get_one_near_misses():
+    data = [{"n": "foo", "l": "CH"}, {"n": "foo", "l": "DE"}, {"n": "bar", "l": "FR"}]
+    with pytest.raises(NoResults) as error:
+        get_one(data, equals("n", "foo"), equals("l", "FR"))
+    message = str(error.value)
+    assert "without equals('n', 'foo'): 1 result(s)" in message
+    assert "without equals('l', 'FR'): 2 result(s)" in message
+
+    with pytest.raises(NoResults) as error:
+        get_one(iter(data), equals("n", "foo"), equals("l", "FR"))
+    assert "without" not in str(error.value)
+
+
+def test_consumer_index():
+    provider = {
+        "name": "a",
+        "reference product": "b",
+        "unit": "kg",
+        "location": "CH",
+        "exchanges": [],
+    }
+    exc = {"name": "a", "product": "b", "unit": "kg", "type": "technosphere"}
+    bio = {"name": "a", "product": "b", "unit": "kg", "type": "biosphere"}
+    consumer = {"exchanges": [exc, bio]}
+    data = [provider, consumer]
+    index = ConsumerIndex(data)
+    assert index.consumers(provider) == [(consumer, exc)]
+    assert index.consumers(exc) == index.consumers(("a", "b", "kg"))
+    assert len(index) == 1
+    assert consumer in index
+
+    # Adding again replaces the old entries
+    other = dict(exc, name="c")
+    consumer["exchanges"].append(other)
+    index.update(consumer)
+    assert len(index) == 2
+    assert index.consumers(other) == [(consumer, other)]
+
+    new = {"exchanges": [dict(exc)]}
+    data.append(new)
+    del data[1]
+    index.sync(data)
+    assert index.consumers(provider) == [(new, new["exchanges"][0])]
+    assert consumer not in index
+    assert index.consumers(other) == []
+
+    located = ConsumerIndex(
+        [{"exchanges": [dict(exc, location="CH")]}],
+        fields=("name", "product", "unit", "location"),
+    )
+    assert len(located.consumers(provider)) == 1
+    assert located.consumers(dict(provider, location="FR")) == []
+
+
+def test_provider_index():
+    data = [
+        {"name": "a", "reference product": "b", "unit": "kg", "location": "CH"},
+        {"name": "a", "reference product": "c", "unit": "kg", "location": "CH"},
+    ]
+    index = DatasetIndex(data)
+    providers = index.providers
+    assert isinstance(providers, ProviderIndex)
+    assert providers.get(("a", "b", "kg")) == [data[0]]
+    assert providers.providers({"name": "a", "product": "c", "unit": "kg"}) == [data[1]]
+
+    index.append(
+        {"name": "a", "reference product": "b", "unit": "kg", "location": "FR"}
+    )
+    assert len(providers.get(("a", "b", "kg"))) == 2
+
+    data[1]["reference product"] = "b"
+    mark_modified(index, ["reference product"])
+    assert len(providers.get(("a", "b", "kg"))) == 3
+    assert providers.get(("a", "c", "kg")) == []
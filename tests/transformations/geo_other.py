@@ -1,6 +1,7 @@
 import pytest
 
 from wurst.transformations.geo import *
+from wurst.transformations.utils import clone_exchange
 
 
 def test_copy_to_new_location():
@@ -79,6 +80,30 @@ def test_allocate_inputs_pv():
     assert exc == {"amount": 2}
 
 
+def test_allocate_inputs_doesnt_deepcopy():
+    given = [
+        {
+            "location": loc,
+            "exchanges": [{"type": "production", "production volume": 1, "amount": 1}],
+        }
+        for loc in ("here", "there", "everywhere")
+    ]
+    exc = {"amount": 3, "properties": {"carbon": 1}, "pedigree": {"reliability": 2}}
+    result = allocate_inputs(exc, given)
+    assert [obj["amount"] for obj in result] == [1, 1, 1]
+    assert all(type(obj["amount"]) is float for obj in result)
+    assert result[0]["properties"] is exc["properties"]
+    result[0]["pedigree"]["reliability"] = 5
+    assert exc["pedigree"] == result[1]["pedigree"] == {"reliability": 2}
+
+
+def test_clone_exchange():
+    exc = {"amount": 1, "loc": 1, "uncertainty type": 2, "pedigree": {"a": 1}}
+    cp = clone_exchange(exc)
+    assert cp == exc
+    assert cp is not exc and cp["pedigree"] is not exc["pedigree"]
+
+
 def test_get_possibles():
     exc = {"name": "one", "product": "two", "unit": "three"}
     given = [
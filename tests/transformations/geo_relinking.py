@@ -1,5 +1,9 @@
+from copy import deepcopy
+
 import pytest
 
+from wurst.indexing import ConsumerIndex, DatasetIndex, ProviderIndex
+
 from wurst.transformations.geo import *
 
 
@@ -626,3 +630,96 @@ def test_relink_intersects(defaults):
         relink_technosphere_exchanges(ds, data, exclusive=False, contained=False)
         == expected
     )
+
+
+def test_relink_updates_consumer_index(defaults):
+    data, ds = defaults
+    consumers = ConsumerIndex([ds])
+    assert len(consumers.consumers(data[0])) == 1
+    relink_technosphere_exchanges(ds, data, consumers=consumers)
+    assert len(consumers.consumers(data[0])) == 3
+    assert all(exc in ds["exchanges"] for _, exc in consumers.consumers(data[0]))
+
+    cp = copy_to_new_location(ds, "FR", consumers=consumers)
+    assert sum(obj is cp for obj, _ in consumers.consumers(data[0])) == 3
+
+
+def test_get_possibles_with_provider_index(defaults):
+    data, ds = defaults
+    providers = ProviderIndex(data)
+    exc = ds["exchanges"][0]
+    assert list(get_possibles(exc, data, providers)) == list(get_possibles(exc, data))
+
+    data.append(dict(data[0], location="FI"))
+    assert [obj["location"] for obj in get_possibles(exc, data, providers)] == [
+        "SE",
+        "NO",
+        "RoW",
+        "FI",
+    ]
+
+
+def test_relink_with_provider_index(defaults):
+    data, ds = defaults
+    expected = relink_technosphere_exchanges(deepcopy(ds), data)
+    assert (
+        relink_technosphere_exchanges(deepcopy(ds), data, providers=ProviderIndex(data))
+        == expected
+    )
+    assert relink_technosphere_exchanges(ds, DatasetIndex(data)) == expected
+
+
+def test_relink_many(defaults, monkeypatch):
+    data, ds = defaults
+    expected = relink_technosphere_exchanges(deepcopy(ds), data)
+    datasets = [deepcopy(ds) for _ in range(3)]
+
+    calls = []
+    original = provider_locations
+
+    def counting(*args):
+        calls.append(args[0])
+        return original(*args)
+
+    monkeypatch.setattr("wurst.transformations.geo.provider_locations", counting)
+    assert relink_technosphere_exchanges_many(datasets, data) is datasets
+    assert all(obj == expected for obj in datasets)
+    # One geo question per unique (location, providers) combination
+    assert len(calls) == 2
+
+
+def test_relink_many_invalid_changes_nothing(defaults):
+    data, ds = defaults
+    other = deepcopy(ds)
+    # No provider for D/E/F in or around the US
+    other["location"] = "US"
+    before = [deepcopy(ds), deepcopy(other)]
+    with pytest.raises(InvalidLink):
+        relink_technosphere_exchanges_many([ds, other], data)
+    assert [ds, other] == before
+
+
+def test_provider_locations():
+    assert provider_locations("DK", ["SE", "NO", "RoW"]) == ["RoW"]
+    assert provider_locations(("ecoinvent", "UN-NEUROPE"), ["SE", "GLO"]) == ["SE"]
+    assert provider_locations("DK", ["SE", "GLO"]) == ["GLO"]
+    assert provider_locations("DK", ["SE"]) == []
+
+
+def test_provider_locations_cache():
+    clear_geo_cache()
+    first = provider_locations("DK", ["SE", "NO", "RoW", "SE"])
+    first.append("changed")
+    assert provider_locations("DK", ["SE", "NO", "RoW"]) == ["RoW"]
+    assert geo_cache_info().hits == 1
+    clear_geo_cache()
+    assert geo_cache_info().currsize == 0
+
+
+def test_relink_many_uses_geo_cache(defaults):
+    data, ds = defaults
+    clear_geo_cache()
+    relink_technosphere_exchanges_many([deepcopy(ds) for _ in range(3)], data)
+    relink_technosphere_exchanges_many([deepcopy(ds) for _ in range(3)], data)
+    info = geo_cache_info()
+    assert (info.misses, info.hits, info.currsize) == (2, 2, 2)